@@ -85,10 +85,15 @@ async def translate(request: TranslateRequest):
 if __name__ == "__main__":
     import uvicorn
 
+    reload = os.getenv("RELOAD", "0") == "1"  # 仅开发时开启自动重载（与多worker互斥）
     uvicorn.run(
         "AI_Translate:app",  # 替换为你的文件名（比如translate.py则写"translate:app"）
-        host="0.0.0.0",# 监听所有IP
-        port=8000,#
-        reload=True,# 自动重载
-        log_level="debug"# 日志级别
+        host=os.getenv("HOST", "0.0.0.0"),# 监听所有IP
+        port=int(os.getenv("PORT", "8000")),#
+        workers=None if reload else int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),# 多进程
+        reload=reload,# 自动重载
+        loop="auto",# 已安装uvloop时自动使用
+        http="auto",# 已安装httptools时自动使用
+        timeout_graceful_shutdown=30,# 优雅退出
+        log_level=os.getenv("LOG_LEVEL", "info")# 日志级别
     )
\ No newline at end of file
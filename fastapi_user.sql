@@ -17,4 +17,12 @@ ALTER TABLE sys_user ADD COLUMN is_active TINYINT(1) DEFAULT 0 COMMENT '是否
 ALTER TABLE sys_user 
 ADD COLUMN nickname VARCHAR(50) DEFAULT '默认用户' COMMENT '用户昵称' AFTER password,
 ADD COLUMN avatar VARCHAR(255) DEFAULT '' COMMENT '用户头像存储路径' AFTER nickname,
-ADD COLUMN hobby_list VARCHAR(500) DEFAULT '' COMMENT '兴趣爱好列表，逗号分隔' AFTER avatar;
\ No newline at end of file
+ADD COLUMN hobby_list VARCHAR(500) DEFAULT '' COMMENT '兴趣爱好列表，逗号分隔' AFTER avatar;
+
+-- 登出Token黑名单（多worker进程共享），按Token的SHA256存储，过期后可清理，执行一次即可
+CREATE TABLE IF NOT EXISTS sys_token_blacklist (
+  token_hash VARCHAR(64) NOT NULL COMMENT 'Token的SHA256',
+  expire_time DATETIME NOT NULL COMMENT 'Token过期时间，之后记录可删除',
+  PRIMARY KEY (token_hash),
+  KEY idx_expire_time (expire_time)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='登出Token黑名单';
@@ -1,7 +1,8 @@
 from datetime import datetime
-from random import randint
+from random import randint, random
 
-from fastapi import FastAPI, HTTPException, Body, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Body, Depends, status, UploadFile, File, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, field_validator
@@ -10,15 +11,29 @@ from sqlalchemy import create_engine, Column, BigInteger, String, DateTime, Bool
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 from sqlalchemy.sql import func
 import re
+import asyncio
+import contextvars
+import threading
 import jwt
 import time
-import uuid
 import yagmail
 import os
 from typing import List, Optional, Set
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware  # 新增：导入跨域中间件
 import stable_diff
+import image_storage
+import thumbnails
+import tracing
+import translation_memory
+import long_text
+import llm_hedge
+import metrics
+import zip_stream
+import keywords
+import search_index
+import profiler
+import hashlib
 
 
 from pydantic import BaseModel
@@ -48,20 +63,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有请求方法：GET/POST/PUT/DELETE等
     allow_headers=["*"],  # 允许所有请求头：包括你的Bearer Token请求头
+    expose_headers=[tracing.TRACE_HEADER, "X-Profile-Id"],  # 允许前端读取链路追踪ID、采样结果ID
 )
+# 链路追踪：每个请求生成trace id，并在响应头 X-Trace-Id 中返回
+app.add_middleware(tracing.TraceMiddleware)
+# 按需采样：PROFILER_ENABLED=1 时，携带 X-Debug-Profile: <PROFILER_TOKEN> 的请求在处理期间采样调用栈
+app.add_middleware(profiler.ProfileMiddleware)
 from config import SEND_EMAIL, SEND_EMAIL_PWD, SEND_EMAIL_HOST, SERVER_DOMAIN
 
 # ========== 核心配置（可灵活修改） ==========
 AVATAR_UPLOAD_DIR = "static/avatar"  # 头像存储目录
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}  # 允许的头像格式
 MAX_HOBBY_NUM = 10  # ✅兴趣列表最大数量，可按需修改（当前配置10个）
-TOKEN_BLACKLIST: Set[str] = set()  # ✅Token黑名单，登出后加入这里，全局生效
+TOKEN_BLACKLIST: Set[str] = set()  # ✅本进程已确认登出的Token缓存；多worker共享的黑名单保存在数据库 sys_token_blacklist
 
 # JWT Token配置
 SECRET_KEY = os.getenv("SECRET_KEY") # 从环境变量获取密钥
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 ACTIVE_TOKEN_EXPIRE_HOURS = 24
+# 管理员邮箱（逗号分隔），可访问采样分析等调试接口
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
 
 # ========== 【修改这里！你的MySQL数据库配置】 ==========
 from config import DB_URL
@@ -73,6 +95,19 @@ Base = declarative_base()
 os.makedirs(AVATAR_UPLOAD_DIR, exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 图片存储后端：本地分片目录（/static访问）或S3兼容存储（预签名链接）
+storage = image_storage.get_storage(base_url=f"{SERVER_DOMAIN}/static")
+
+# 预加载关键词提取词典（多进程启动时在fork前完成，worker共享）
+keywords.warm_up()
+
+
+@app.on_event("shutdown")
+def shutdown_thumbnail_workers():
+    # 等待后台缩略图任务完成后再退出
+    thumbnails.shutdown()
+    stable_diff.render_executor.shutdown(wait=False, cancel_futures=True)
+
 # 密码加密配置 - 零依赖 无报错
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
@@ -94,17 +129,27 @@ class DBUser(Base):
     update_time = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False, comment="更新时间")
 
 
+class DBTokenBlacklist(Base):
+    # 登出Token黑名单：多worker进程共享，按Token哈希存储，过期后可清理
+    __tablename__ = "sys_token_blacklist"
+    token_hash = Column(String(64), primary_key=True, comment="Token的SHA256")
+    expire_time = Column(DateTime, nullable=False, index=True, comment="Token过期时间，之后记录可删除")
+
+
 # 自动建表（已存在则不修改）
 Base.metadata.create_all(bind=engine)
 
 
 # ===================== 通用工具函数 =====================
 def get_db():
+    # 生成器依赖可能跨线程执行，Span不设为当前上下文
+    db_span = tracing.start_span("db.session", activate=False)
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        db_span.end()
 
 
 # 邮箱格式校验
@@ -167,28 +212,43 @@ def get_current_user(token: str = Depends(api_key_header), db: Session = Depends
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        # 1. 校验Token格式
-        if not token or not token.startswith("Bearer "):
-            raise credentials_exception
-        token_str = token.replace("Bearer ", "")
-
-        # 2. ✅核心新增：校验Token是否在黑名单（登出后失效）
-        if token_str in TOKEN_BLACKLIST:
-            raise credentials_exception
-
-        # 3. 解析Token+校验用户
-        payload = jwt.decode(token_str, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        user = get_user_by_email(db, email=email)
-        if user is None:
-            raise credentials_exception
-        return user, token_str  # 返回用户信息+纯token字符串（供登出使用）
+        with tracing.span("auth.get_current_user"):
+            # 1. 校验Token格式
+            if not token or not token.startswith("Bearer "):
+                raise credentials_exception
+            token_str = token.replace("Bearer ", "")
+
+            # 2. ✅核心新增：校验Token是否在黑名单（登出后失效，其他worker登出的Token查数据库）
+            if token_str in TOKEN_BLACKLIST:
+                raise credentials_exception
+            if db.get(DBTokenBlacklist, token_hash(token_str)) is not None:
+                TOKEN_BLACKLIST.add(token_str)
+                raise credentials_exception
+
+            # 3. 解析Token+校验用户
+            payload = jwt.decode(token_str, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+            user = get_user_by_email(db, email=email)
+            if user is None:
+                raise credentials_exception
+            return user, token_str  # 返回用户信息+纯token字符串（供登出使用）
     except:
         raise credentials_exception
 
 
+def token_hash(token_str: str) -> str:
+    return hashlib.sha256(token_str.encode("utf-8")).hexdigest()
+
+
+def get_admin_user(user_token: tuple = Depends(get_current_user)):
+    user, _ = user_token
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+    return user_token
+
+
 # 在后端fastapi_user.py中添加以下API
 
 
@@ -344,21 +404,15 @@ def upload_avatar(file: UploadFile = File(...), db: Session = Depends(get_db),
         if len(file_content) > 5 * 1024 * 1024:  # 5MB
             return {"code": 400, "msg": "文件大小不能超过5MB"}
 
-        # 重置文件指针，因为上面已经读取过了
-        file.file.seek(0)
-
         ext = file.filename.rsplit(".", 1)[1].lower()
-        filename = f"{uuid.uuid4()}.{ext}"
-        file_path = os.path.join(AVATAR_UPLOAD_DIR, filename)
+        # 按内容哈希分片保存，相同头像只存一份
+        key = storage.save_content(file_content, ext, prefix="avatar")
 
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
-
-        user.avatar = f"{SERVER_DOMAIN}/{file_path}"
+        # 数据库只保存存储Key，读取时再生成链接（S3预签名链接会过期）
+        user.avatar = key
         db.commit()
-        print(user.avatar)
 
-        return {"code": 200, "msg": "头像上传成功", "data": {"avatar_url": user.avatar}}
+        return {"code": 200, "msg": "头像上传成功", "data": {"avatar_url": avatar_url(user.avatar)}}
 
     except HTTPException:
         # 如果是已知的HTTP异常，转换为JSON响应
@@ -369,6 +423,13 @@ def upload_avatar(file: UploadFile = File(...), db: Session = Depends(get_db),
         return {"code": 500, "msg": f"头像上传失败：{str(e)}"}
 
 
+def avatar_url(avatar: Optional[str]) -> str:
+    # 旧数据保存的是完整链接，直接返回；新数据保存存储Key
+    if not avatar or avatar.startswith(("http://", "https://")):
+        return avatar or ""
+    return storage.url(avatar)
+
+
 # 7. ✅核心升级：兴趣列表管理（增选改排+上限10个+去重+排序）- 完全匹配需求
 @app.post("/api/user/save_hobby", summary="兴趣列表管理-增/选/改/排，上限10个，自动去重", tags=["用户信息修改"])
 def save_hobby(data: HobbyListRequest = Body(...), db: Session = Depends(get_db),
@@ -388,9 +449,14 @@ def save_hobby(data: HobbyListRequest = Body(...), db: Session = Depends(get_db)
 
 # 8. ✅核心新增：用户安全登出 - Token立即加入黑名单，永久失效
 @app.post("/api/user/logout", summary="用户登出-Token立即失效，无法复用", tags=["用户模块"])
-def user_logout(user_token: tuple = Depends(get_current_user)):
+def user_logout(user_token: tuple = Depends(get_current_user), db: Session = Depends(get_db)):
     _, token_str = user_token
-    # 将当前Token加入黑名单，全局生效
+    # 将当前Token写入数据库黑名单，所有worker进程生效；顺带清理已过期的记录
+    payload = jwt.decode(token_str, SECRET_KEY, algorithms=[ALGORITHM])
+    now = datetime.now()
+    db.query(DBTokenBlacklist).filter(DBTokenBlacklist.expire_time < now).delete(synchronize_session=False)
+    db.merge(DBTokenBlacklist(token_hash=token_hash(token_str), expire_time=datetime.fromtimestamp(payload["exp"])))
+    db.commit()
     TOKEN_BLACKLIST.add(token_str)
     return {"code": 200, "msg": "登出成功！您的登录凭证已失效，请重新登录"}
 
@@ -405,7 +471,7 @@ def get_info(user_token: tuple = Depends(get_current_user)):
         "code": 200, "msg": "获取信息成功",
         "data": {
             "user_id": user.id, "email": user.email, "nickname": user.nickname,
-            "avatar": user.avatar, "hobby_list": hobby_list, "is_active": user.is_active,
+            "avatar": avatar_url(user.avatar), "hobby_list": hobby_list, "is_active": user.is_active,
             "create_time": user.create_time.strftime("%Y-%m-%d %H:%M:%S"),
             "hobby_count": len(hobby_list),
             "max_hobby_num": MAX_HOBBY_NUM
@@ -431,10 +497,22 @@ class TranslateResponse(BaseModel):
 
 
 # 5. 核心翻译函数
-def call_bailian_model(prompt: str) -> dict:
+def call_bailian_model(prompt: str, endpoint: str = "default") -> dict:
+    """
+    在接口截止时间内调用大模型，慢请求会自动发起对冲请求
+    :param endpoint: 接口名（translate/stable），决定截止时间和延迟统计
+    """
     try:
+        with tracing.span("llm.call", endpoint=endpoint, prompt_chars=len(prompt)):
+            return llm_hedge.call(generate_by_bailian, prompt, endpoint)
+    except Exception as e:
+        raise Exception(f"百炼模型调用异常：{str(e)}")
+
+
+def generate_by_bailian(prompt: str, model: str = llm_hedge.LLM_MODEL) -> dict:
+    with tracing.span("llm.generate", model=model):
         response = Generation.call(
-            model='qwen-plus',
+            model=model,
             messages=[{"role": "user", "content": prompt}],
             result_format='json',
             temperature=0.1,
@@ -443,10 +521,62 @@ def call_bailian_model(prompt: str) -> dict:
         if response.status_code != 200:
             raise Exception(f"百炼API调用失败：{response.code} - {response.message}")
         return json.loads(response.output.choices[0].message.content)
-    except Exception as e:
-        raise Exception(f"百炼模型调用异常：{str(e)}")
 
-# 6. 翻译接口（需要登录才能调用）
+# 6. 单段翻译：先查翻译记忆，未命中再调用大模型
+def translate_segment(input_text: str, target_Lang: str) -> tuple:
+    # 关键词须为中文：原文或译文是中文时本地提取，否则（如英译日）仍由大模型返回
+    local_keywords = keywords.KEYWORDS_MODE == "local" and (
+        keywords.is_chinese(input_text) or keywords.is_chinese_lang(target_Lang))
+    # 先查翻译记忆（精确/模糊匹配），命中则无需调用大模型
+    memory = translation_memory.get_memory() if translation_memory.TM_ENABLED else None
+    if memory is not None:
+        with tracing.span("tm.lookup") as tm_span:
+            match = memory.lookup(input_text, target_Lang)
+            tm_span.set_attribute("hit", match is not None)
+        if match is not None:
+            if local_keywords:
+                with tracing.span("keywords.extract"):
+                    return match.translation, keywords.chinese_keywords(input_text, match.translation)
+            if match.keywords:
+                return match.translation, match.keywords
+
+    if local_keywords and random() >= keywords.KEYWORDS_REFERENCE_RATE:
+        # 关键词在本地提取，大模型只负责翻译，输出更短、格式更简单
+        prompt = f"""
+           你是一个专业的翻译模型，请将输入的文本翻译成准确流畅的{target_Lang}。
+           请使用JSON格式返回结果，请勿添加其他内容：
+           {{
+             "translation": "将「{input_text}」翻译成准确流畅的{target_Lang}"
+           }}
+           """
+        model_result = call_bailian_model(prompt, endpoint="translate")
+        if not isinstance(model_result, dict) or "translation" not in model_result:
+            raise Exception("模型返回格式错误，缺少translation字段")
+        if memory is not None:
+            # 记忆中只保存大模型给出的关键词，本地关键词每次重新提取
+            memory.add(input_text, target_Lang, model_result["translation"], [])
+        with tracing.span("keywords.extract"):
+            return model_result["translation"], keywords.chinese_keywords(input_text, model_result["translation"])
+
+    prompt = f"""
+           你是一个专业的翻译模型，请将输入的文本翻译成准确流畅的{target_Lang}，并提取1-5个核心中文关键词。
+           请使用JSON格式返回结果，请勿添加其他内容：
+           {{
+             "translation": "将「{input_text}」翻译成准确流畅的{target_Lang}",
+             "keywords": ["提取1-5个核心中文关键词"]
+           }}
+           """
+    model_result = call_bailian_model(prompt, endpoint="translate")
+
+    if not isinstance(model_result, dict) or "translation" not in model_result or "keywords" not in model_result:
+        raise Exception("模型返回格式错误，缺少translation/keywords字段")
+
+    if memory is not None:
+        memory.add(input_text, target_Lang, model_result["translation"], model_result["keywords"])
+    return model_result["translation"], model_result["keywords"]
+
+
+# 翻译接口（需要登录才能调用）
 @app.post("/api/translate", response_model=TranslateResponse,tags=["功能"])
 async def translate(
     request: TranslateRequest,
@@ -458,34 +588,113 @@ async def translate(
         raise HTTPException(status_code=400, detail="输入文本不能为空")
 
     try:
-        prompt = f"""
-               你是一个专业的翻译模型，请将输入的文本翻译成准确流畅的{target_Lang}，并提取1-5个核心中文关键词。
-               请使用JSON格式返回结果，请勿添加其他内容：
-               {{
-                 "translation": "将「{input_text}」翻译成准确流畅的{target_Lang}",
-                 "keywords": ["提取1-5个核心中文关键词"]
-               }}
-               """
-        model_result = call_bailian_model(prompt)
-
-        if not isinstance(model_result, dict) or "translation" not in model_result or "keywords" not in model_result:
-            raise Exception("模型返回格式错误，缺少translation/keywords字段")
+        if len(input_text) > long_text.LONG_TEXT_THRESHOLD:
+            # 长文本：按段落/句子切块并发翻译，再按原顺序拼接
+            translation, keyword_list = await long_text.translate_long(input_text, target_Lang, translate_segment)
+        else:
+            # 大模型调用会阻塞到截止时间，放到线程中执行，避免卡住事件循环
+            translation, keyword_list = await asyncio.to_thread(translate_segment, input_text, target_Lang)
 
         return TranslateResponse(
-            translation=model_result["translation"],
-            keywords=model_result["keywords"]
+            translation=translation,
+            keywords=keyword_list
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"翻译失败：{str(e)}")
 
+SD_DISCONNECT_POLL_SECONDS = 0.5  # 渲染期间检查客户端是否断开的间隔
+
+metrics.register_gauge("sd.gpu_seconds_saved_ratio",
+                       metrics.ratio("sd.gpu_seconds_saved", "sd.gpu_seconds_requested"))
+
+
+_cancel_tasks: Set[asyncio.Task] = set()  # 后台中断任务，保留引用避免被回收
+
+
+async def interrupt_when_active(task: asyncio.Future, task_id: str) -> None:
+    """
+    任务正在渲染时立即中断；仍在SD队列中排在其他请求之后时持续轮询，开始渲染后再中断
+    只有实际发出中断时才计入节省的GPU时间
+    """
+    average = stable_diff.average_render_seconds()
+    while not task.done():
+        progress = await asyncio.to_thread(stable_diff.interrupt, task_id)
+        if progress is not None:
+            metrics.inc("sd.gpu_seconds_wasted", average * progress)
+            metrics.inc("sd.gpu_seconds_saved", average * (1 - progress))
+            return
+        await asyncio.wait({task}, timeout=SD_DISCONNECT_POLL_SECONDS)
+    if task.result() is None:
+        # 还在渲染线程池中排队就已取消，没有发给SD
+        metrics.inc("sd.gpu_seconds_saved", average)
+        return
+    # 中断前已渲染完成，整张图的渲染时间都浪费了
+    metrics.inc("sd.gpu_seconds_wasted", average)
+
+
+async def render_until_disconnect(raw_request: Request, **kwargs):
+    """
+    在渲染专用线程池中渲染一张图片，同时监听客户端断开；断开或请求被取消时中断SD渲染
+    :return: (image, save_path, 是否已断开)
+    """
+    task_id = stable_diff.new_task_id()
+    cancel_event = threading.Event()
+    started = time.monotonic()
+
+    def render():
+        if cancel_event.is_set():  # 排队期间已取消，不再发给SD
+            return None
+        return stable_diff.generate_image_by_qiuye(task_id=task_id, cancel_event=cancel_event, **kwargs)
+
+    # run_in_executor 不会像 asyncio.to_thread 那样带上上下文，手动复制以保留链路追踪
+    context = contextvars.copy_context()
+    task = asyncio.get_running_loop().run_in_executor(stable_diff.render_executor, context.run, render)
+
+    def cancel_render():
+        cancel_event.set()
+        # 中断请求可能耗时数秒，在后台任务中执行，不阻塞事件循环和取消流程
+        cancel_task = asyncio.ensure_future(interrupt_when_active(task, task_id))
+        _cancel_tasks.add(cancel_task)
+        cancel_task.add_done_callback(_cancel_tasks.discard)
+
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=SD_DISCONNECT_POLL_SECONDS)
+            if not task.done() and await raw_request.is_disconnected():
+                cancel_render()
+                return None, None, True
+    except asyncio.CancelledError:
+        cancel_render()
+        raise
+
+    image, save_path = task.result()
+    if save_path:
+        stable_diff.record_render_seconds(time.monotonic() - started)
+    return image, save_path, False
+
+
+def save_generated(email: str, record: dict) -> str:
+    """
+    保存生成图片的用户记录，提交缩略图任务并更新检索索引
+    :return: 图片访问URL
+    """
+    record_key = storage.save_record(email, record)
+    # 后台进程生成WebP缩略图，完成后写回记录
+    thumbnails.submit(record["key"], record_key)
+    # 增量更新提示词检索索引
+    with tracing.span("search.index"):
+        search_index.add(email, record)
+    return storage.url(record["key"])
+
+
 # 7. 画图接口（需要登录才能调用）
 @app.post("/api/stable", summary="使用大模型生成有效的提示词，生成图片",tags=["stable图片生成"])
 async def stable_generate(
+    raw_request: Request,
     request: KeyWordRequest,
     user_token: tuple = Depends(get_current_user)  # 添加这行来要求用户登录
 ):
     user, _ = user_token
-    user = user.email.split('.')[0]
 
     input_text = request.text.strip()
     model = request.model.strip()
@@ -505,51 +714,87 @@ async def stable_generate(
                  "Reverse": f"{input_text}反向提示词"
                }}
                """
-        model_result = call_bailian_model(prompt)
+        model_result = await asyncio.to_thread(call_bailian_model, prompt, "stable")
 
         if not isinstance(model_result, dict) or "Positive" not in model_result or "Reverse" not in model_result:
             raise Exception("模型返回格式错误，缺少Positive/Reverse字段")
 
 
-        for i in range(randint(3,6)):
-            image,save_path =stable_diff.generate_image_by_qiuye(prompt= model_result["Positive"],
-                                                       negative_prompt=model_result["Reverse"],
-                                                       steps=randint(20,30),
-                                                       save_dir=f"static/{user}",
-                                                       model_name=stable_diff.get_model_by_style(model))
+        model_name = stable_diff.get_model_by_style(model)
+        image_url = None
+        image_count = randint(3,6)
+        metrics.inc("sd.gpu_seconds_requested", image_count * stable_diff.average_render_seconds())
+        for i in range(image_count):
+            # 客户端已断开（关闭App/重试）时不再渲染剩余图片
+            if await raw_request.is_disconnected():
+                disconnected, save_path, skipped = True, None, image_count - i
+            else:
+                saved = {}
+                image, save_path, disconnected = await render_until_disconnect(
+                    raw_request,
+                    prompt=model_result["Positive"],
+                    negative_prompt=model_result["Reverse"],
+                    steps=randint(20,30),
+                    model_name=model_name,
+                    storage=storage,
+                    saved=saved)
+                skipped = image_count - i - 1
+            if disconnected:
+                metrics.inc("sd.cancelled_requests")
+                metrics.inc("sd.images_skipped", skipped)
+                metrics.inc("sd.gpu_seconds_saved", skipped * stable_diff.average_render_seconds())
+                print(f"⚠️ 客户端已断开，跳过剩余{skipped}张图片")
+                break
             if save_path:
-                # 创建专门存放提示词的目录
-                prompt_dir = os.path.join(os.path.dirname(save_path), "prompts")
-                os.makedirs(prompt_dir, exist_ok=True)
-
-                base_path = os.path.splitext(save_path)[0]  # 移除文件扩展名
-                # 将提示词文件保存到专门的prompts子目录中
-                pos_prompt_file = os.path.join(prompt_dir, os.path.basename(base_path) + "_prompt.txt")
-                neg_prompt_file = os.path.join(prompt_dir, os.path.basename(base_path) + "_neg_prompt.txt")
-
-                # 保存正向提示词
-                with open(pos_prompt_file, 'w', encoding='utf-8') as f:
-                    f.write(model_result["Positive"])
-
-                # 保存反向提示词
-                with open(neg_prompt_file, 'w', encoding='utf-8') as f:
-                    f.write(model_result["Reverse"])
-        return {"code": 200, "msg": "生成成功", "data": {"image_url": f"{SERVER_DOMAIN}/{save_path}","prompt": model_result["Positive"],"negative_prompt": model_result["Reverse"]}}
+                # 图片按内容寻址保存，提示词等信息写入用户记录
+                record = {
+                    "key": save_path,
+                    "prompt": model_result["Positive"],
+                    "negative_prompt": model_result["Reverse"],
+                    "style": model,
+                    "model": model_name,
+                    "date": time.time(),
+                    # 大小和CRC32在保存时算出，导出图库时直接使用，无需查询或重读图片
+                    "size": saved["size"],
+                    "crc32": saved["crc32"],
+                }
+                # 写记录、检索索引都是磁盘/S3 IO，放到线程中执行，避免卡住事件循环
+                image_url = await asyncio.to_thread(save_generated, user.email, record)
+        return {"code": 200, "msg": "生成成功", "data": {"image_url": image_url,"prompt": model_result["Positive"],"negative_prompt": model_result["Reverse"]}}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"大模型生成失败：{str(e)}")
 
 @app.get("/api/stable/gallery", summary="获取用户生成的图片列表", tags=["stable图片生成"])
-async def get_gallery(
+def get_gallery(
         user_token: tuple = Depends(get_current_user)
 ):
     user, _ = user_token
-    user_dir = user.email.split('.')[0]  # 获取邮箱用户名部分
 
-    gallery_dir = f"static/{user_dir}"
+    # 新版存储：按用户记录读取
+    image_files = [{
+        "image_url": storage.url(record["key"]),
+        "prompt": record.get("prompt", "未知提示词"),
+        "negative_prompt": record.get("negative_prompt", "未知反向提示词"),
+        "date": record.get("date", 0),
+        # 缩略图尚未生成时为空，客户端回退到原图
+        "thumbnails": {size: storage.url(key) for size, key in record.get("thumbnails", {}).items()}
+    } for record in storage.list_records(user.email)]
+
+    # 兼容旧版平铺目录 static/{邮箱用户名} 中的历史图片
+    image_files.extend(list_legacy_gallery(f"static/{user.email.split('.')[0]}"))
+
+    # 按时间倒序排列（最新的在前）
+    image_files.sort(key=lambda x: x["date"], reverse=True)
+    return {"code": 200, "msg": "获取成功", "data": image_files}
+
 
+def list_legacy_gallery(gallery_dir: str) -> list:
+    """
+    读取旧版平铺目录中的图片及prompts子目录下的提示词文件
+    """
     if not os.path.exists(gallery_dir):
-        return {"code": 200, "msg": "目录不存在", "data": []}
+        return []
 
     # 获取目录下的所有图片文件
     image_files = []
@@ -594,20 +839,235 @@ async def get_gallery(
                 timestamp = os.path.getmtime(os.path.join(gallery_dir, filename))
 
             image_path = f"{SERVER_DOMAIN}/{gallery_dir}/{filename}"
+            thumbs = thumbnails.legacy_thumbnails(os.path.join(gallery_dir, filename))
             image_files.append({
                 "image_url": image_path,
                 "prompt": prompt,
                 "negative_prompt": negative_prompt,
-                "date": timestamp  # 获取创建时间
+                "date": timestamp,  # 获取创建时间
+                # 由 python thumbnails.py 补生成，未生成时为空
+                "thumbnails": {size: f"{SERVER_DOMAIN}/{path.replace(os.sep, '/')}" for size, path in thumbs.items()}
             })
+    return image_files
 
-    # 按时间倒序排列（最新的在前）
-    image_files.sort(key=lambda x: x["date"], reverse=True)
-    return {"code": 200, "msg": "获取成功", "data": image_files}
 
+@app.get("/api/stable/gallery/search", summary="按提示词/风格/模型搜索用户图片（分页）", tags=["stable图片生成"])
+def search_gallery(
+        q: str,
+        field: str = "all",
+        sort: str = "date",
+        page: int = 1,
+        page_size: int = 20,
+        user_token: tuple = Depends(get_current_user)
+):
+    """
+    :param q: 搜索词，空格分隔的多个词需同时命中，如“古风 mountains”
+    :param field: all/prompt/negative_prompt/style/model
+    :param sort: date（最新在前，默认）/relevance（相关度）
+    """
+    user, _ = user_token
+    if field != "all" and field not in search_index.SEARCH_FIELDS:
+        raise HTTPException(status_code=400, detail="不支持的搜索字段")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+
+    if not search_index.exists(user.email):
+        # 首次搜索时用已有记录和旧版图库全量建立索引，之后随生成增量更新
+        def load_legacy():
+            return [{
+                "id": os.path.splitext(os.path.basename(item["image_url"]))[0],
+                "path": item["image_url"][len(SERVER_DOMAIN) + 1:],
+                "prompt": item["prompt"],
+                "negative_prompt": item["negative_prompt"],
+                "date": item["date"],
+                "thumbnails": {size: url[len(SERVER_DOMAIN) + 1:] for size, url in item["thumbnails"].items()},
+            } for item in list_legacy_gallery(f"static/{user.email.split('.')[0]}")]
+
+        with tracing.span("search.rebuild"):
+            search_index.rebuild(user.email, lambda: storage.list_records(user.email), load_legacy)
+
+    with tracing.span("search.query", field=field):
+        result = search_index.search(user.email, q, field, sort, page, page_size)
+
+    items = []
+    for row in result["items"]:
+        # 缩略图由索引记录提供（生成后写回），不逐个查询存储
+        thumbs = json.loads(row["thumbnails"] or "{}")
+        if row["source"] == "storage":
+            image_url = storage.url(row["location"])
+            thumbs = {size: storage.url(key) for size, key in thumbs.items()}
+        else:
+            image_url = f"{SERVER_DOMAIN}/{row['location']}"
+            thumbs = {size: f"{SERVER_DOMAIN}/{path}" for size, path in thumbs.items()}
+        items.append({
+            "image_url": image_url,
+            "prompt": row["prompt"],
+            "negative_prompt": row["negative_prompt"],
+            "style": row["style"],
+            "model": row["model"],
+            "date": row["date"],
+            "thumbnails": thumbs,
+        })
+    return {"code": 200, "msg": "搜索成功",
+            "data": {"total": result["total"], "page": page, "page_size": page_size, "items": items}}
+
+
+def build_gallery_zip(user) -> zip_stream.ZipStream:
+    """
+    组装用户图库的压缩包条目（只记录大小和读取方式，不读取内容）
+    内存占用与图片数量成正比（每个条目的名称、大小等），与图片内容大小无关
+    """
+    entries = []
+    for record in storage.list_records(user.email):
+        key = record.get("key")
+        if not key:
+            continue
+        size = record.get("size")
+        if size is None:  # 旧记录没有保存大小
+            try:
+                size = storage.size(key)
+            except FileNotFoundError:
+                continue
+        name = f"images/{record['id']}.{key.rsplit('.', 1)[-1]}"
+        # 内容寻址Key包含内容哈希，作为ETag的内容标识
+        entries.append(zip_stream.ZipEntry(name, size, lambda key=key: storage.iter_chunks(key),
+                                           record.get("date"), key, record.get("crc32")))
+        metadata = {k: record.get(k) for k in ("prompt", "negative_prompt", "style", "model", "date")}
+        entries.append(zip_stream.lazy_bytes_entry(
+            f"images/{record['id']}.json",
+            lambda metadata=metadata: json.dumps(metadata, ensure_ascii=False, indent=2).encode("utf-8"),
+            record.get("date")))
+
+    # 旧版平铺目录中的历史图片及提示词文件
+    legacy_dir = f"static/{user.email.split('.')[0]}"
+    for sub_dir in ("", "prompts"):
+        directory = os.path.join(legacy_dir, sub_dir)
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                # 旧版文件没有内容哈希，用纳秒级修改时间标识内容变化
+                entries.append(zip_stream.ZipEntry(f"legacy/{sub_dir}/{filename}".replace("//", "/"),
+                                                   stat.st_size,
+                                                   lambda path=path: _iter_file(path),
+                                                   stat.st_mtime, str(stat.st_mtime_ns)))
+    return zip_stream.ZipStream(entries)
+
+
+def _iter_file(path: str, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _parse_range(range_header: str, size: int):
+    # 仅支持单个区间：bytes=start-end / bytes=start- / bytes=-suffix
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+@app.get("/api/stable/gallery/export", summary="流式导出用户图库ZIP（支持断点续传）", tags=["stable图片生成"])
+def export_gallery(
+        range_header: Optional[str] = Header(None, alias="Range"),
+        if_range: Optional[str] = Header(None, alias="If-Range"),
+        user_token: tuple = Depends(get_current_user)
+):
+    user, _ = user_token
+    archive = build_gallery_zip(user)
+
+    # 图库内容变化后ETag随之变化（包含内容哈希/修改时间），客户端续传时通过If-Range校验
+    etag = archive.etag
+    headers = {
+        "Content-Disposition": "attachment; filename=gallery.zip",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+    }
+
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_range(range_header, archive.size)
+        if byte_range is None:
+            raise HTTPException(status_code=416, detail="请求的下载区间无效",
+                                headers={"Content-Range": f"bytes */{archive.size}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(archive.iter_bytes(start, end), status_code=206,
+                                 media_type="application/zip", headers=headers)
+
+    headers["Content-Length"] = str(archive.size)
+    return StreamingResponse(archive.iter_bytes(), media_type="application/zip", headers=headers)
+
+
+@app.get("/api/metrics", summary="获取当前worker进程的运行指标（管理员）", tags=["监控"])
+def get_metrics(user_token: tuple = Depends(get_admin_user)):
+    return {"code": 200, "msg": "获取成功", "data": metrics.snapshot()}
+
+
+def _require_profiler():
+    if not profiler.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="采样分析未开启")
 
-# ===================== 启动服务 =====================
-if __name__ == "__main__":
-    import uvicorn
 
-    uvicorn.run("fastapi_user:app", host="192.168.31.219", port=8000)
\ No newline at end of file
+def _profile_response(profile, fmt: str, name: str):
+    # 采样时长和采样线程自身消耗的CPU时间放在响应头中，便于评估开销
+    headers = {"X-Profile-Duration": str(profile.duration), "X-Profile-Overhead-Cpu": str(profile.overhead)}
+    if fmt == "collapsed":
+        return PlainTextResponse(profile.to_collapsed(), headers=headers)
+    return JSONResponse(profile.to_speedscope(name), headers=headers)
+
+
+@app.post("/api/admin/profile", summary="对当前worker进程采样N秒，返回调用栈分析（管理员）", tags=["监控"])
+async def capture_profile(
+    seconds: float = 10,
+    format: str = "speedscope",
+    user_token: tuple = Depends(get_admin_user)
+):
+    """
+    采样所有线程（事件循环、线程池、大模型/绘图调用线程）的调用栈
+    format: speedscope（可直接导入 https://www.speedscope.app）或 collapsed（折叠栈文本，可用于flamegraph.pl）
+    多worker部署时只采样处理本请求的那个worker
+    """
+    _require_profiler()
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(status_code=400, detail="format仅支持 speedscope 或 collapsed")
+    if not 0 < seconds <= profiler.PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"采样时长需在0~{profiler.PROFILER_MAX_SECONDS}秒之间")
+
+    sampler = profiler.SamplingProfiler()
+    if not sampler.start():
+        raise HTTPException(status_code=409, detail="当前进程已有采样在进行，请稍后重试")
+    try:
+        await asyncio.sleep(seconds)  # 采样在后台线程进行，事件循环照常处理其他请求
+    finally:
+        profile = sampler.stop()
+    return _profile_response(profile, format, f"pid {os.getpid()} {seconds}s")
+
+
+@app.get("/api/admin/profile/{profile_id}", summary="获取单个请求的采样结果（管理员）", tags=["监控"])
+def get_request_profile(
+    profile_id: str,
+    format: str = "speedscope",
+    user_token: tuple = Depends(get_admin_user)
+):
+    """
+    profile_id 来自带 X-Debug-Profile 请求头的请求响应头 X-Profile-Id
+    """
+    _require_profiler()
+    profile = profiler.load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="采样结果不存在")
+    return _profile_response(profile, format, f"request {profile_id}")
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+import tracing
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # 仅使用本地存储时无需安装boto3
+    boto3 = None
+    ClientError = Exception
+
+# 1. 存储配置（通过环境变量切换后端）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local / s3
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "static")  # 与 /static 挂载目录一致
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # MinIO等S3兼容服务地址，如 http://127.0.0.1:9000
+S3_BUCKET = os.getenv("S3_BUCKET", "ai-images")
+S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
+S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")  # 配置后直接拼接公开地址，否则生成预签名链接
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "3600"))
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+    "json": "application/json",
+}
+
+
+# 2. Key生成工具函数
+def content_key(data: bytes, ext: str, prefix: str = "images") -> str:
+    """
+    按内容哈希生成对象Key，相同内容得到相同Key（自动去重）
+    格式：images/ab/cd/abcd....png，两级分片避免单目录文件过多
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{prefix}/{digest[:2]}/{digest[2:4]}/{digest}.{ext.lower()}"
+
+
+def user_prefix(email: str) -> str:
+    """
+    根据完整邮箱生成用户专属目录：users/ab/<sha1>
+    替代原来的 email.split('.')[0]，不同账号不会再共享目录
+    """
+    digest = hashlib.sha1(email.strip().lower().encode("utf-8")).hexdigest()
+    return f"users/{digest[:2]}/{digest}"
+
+
+# 3. 存储后端基类
+class BaseStorage:
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def list(self, prefix: str) -> List[str]:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        分块读取对象内容，避免大文件一次性读入内存
+        """
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def save_content(self, data: bytes, ext: str, prefix: str = "images") -> str:
+        """
+        内容寻址保存：已存在相同内容时直接复用，不重复写入
+        :return: 对象Key
+        """
+        key = content_key(data, ext, prefix)
+        if not self.exists(key):
+            self.put(key, data, CONTENT_TYPES.get(ext.lower()))
+        return key
+
+    # ---------- 用户图片记录（替代原来的 prompts/*.txt） ----------
+    def save_record(self, email: str, record: dict) -> str:
+        """
+        保存一条用户生成记录，按月份分片：users/ab/<hash>/records/202601/<id>.json
+        :param record: 至少包含 key、prompt、negative_prompt、date
+        :return: 记录Key
+        """
+        now = datetime.now()
+        record_id = record.get("id") or f"{now.strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+        record["id"] = record_id
+        record_key = f"{user_prefix(email)}/records/{now.strftime('%Y%m')}/{record_id}.json"
+        self.put(record_key, json.dumps(record, ensure_ascii=False).encode("utf-8"), CONTENT_TYPES["json"])
+        return record_key
+
+    def update_record(self, record_key: str, fields: dict) -> None:
+        """
+        合并更新一条已有记录（如后台生成缩略图后写回）
+        """
+        record = json.loads(self.get(record_key).decode("utf-8"))
+        record.update(fields)
+        self.put(record_key, json.dumps(record, ensure_ascii=False).encode("utf-8"), CONTENT_TYPES["json"])
+
+    def list_records(self, email: str) -> List[dict]:
+        """
+        读取用户的全部生成记录（按时间倒序）
+        """
+        records = []
+        for record_key in self.list(f"{user_prefix(email)}/records/"):
+            if not record_key.endswith(".json"):
+                continue
+            try:
+                records.append(json.loads(self.get(record_key).decode("utf-8")))
+            except (ValueError, KeyError, FileNotFoundError):
+                continue
+        records.sort(key=lambda x: x.get("date", 0), reverse=True)
+        return records
+
+
+# 4. 本地磁盘存储（仍通过 /static 访问）
+class LocalStorage(BaseStorage):
+    def __init__(self, root: str = LOCAL_STORAGE_ROOT, base_url: Optional[str] = None):
+        """
+        :param root: 本地根目录，需与 app.mount("/static") 的目录一致
+        :param base_url: 访问前缀，如 http://host:8000/static
+        """
+        self.root = root
+        self.base_url = (base_url or f"/{root}").rstrip("/")
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"非法的存储Key：{key}")
+        return path
+
+    @tracing.traced("storage.local.put")
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到半个文件
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str) -> List[str]:
+        base = self._path(prefix.rstrip("/"))
+        if not os.path.isdir(base):
+            return []
+        keys = []
+        for dir_path, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                full_path = os.path.join(dir_path, filename)
+                keys.append(os.path.relpath(full_path, self.root).replace(os.sep, "/"))
+        return keys
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self._path(key))
+
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+# 5. S3兼容存储（AWS S3 / MinIO 等）
+class S3Storage(BaseStorage):
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 access_key: Optional[str] = S3_ACCESS_KEY, secret_key: Optional[str] = S3_SECRET_KEY,
+                 region: str = S3_REGION, public_url: Optional[str] = S3_PUBLIC_URL,
+                 presign_expires: int = S3_PRESIGN_EXPIRES, client=None):
+        """
+        :param endpoint_url: S3兼容服务地址，本地测试可指向MinIO
+        :param public_url: 桶公开访问前缀，为空时返回预签名链接
+        :param client: 可直接传入已创建的boto3客户端
+        """
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("使用S3存储需要先安装boto3：pip install boto3")
+            client = boto3.client(
+                "s3",
+                endpoint_url=endpoint_url,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+            )
+        self.client = client
+        self.bucket = bucket
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.presign_expires = presign_expires
+
+    @tracing.traced("storage.s3.put")
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+
+    def get(self, key: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            raise FileNotFoundError(key) from e
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix: str) -> List[str]:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return keys
+
+    def size(self, key: str) -> int:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except ClientError as e:
+            raise FileNotFoundError(key) from e
+
+    def iter_chunks(self, key: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            raise FileNotFoundError(key) from e
+        yield from response["Body"].iter_chunks(chunk_size)
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.presign_expires,
+        )
+
+
+# 6. 获取全局存储实例
+_storage: Optional[BaseStorage] = None
+
+
+def get_storage(base_url: Optional[str] = None) -> BaseStorage:
+    """
+    按 STORAGE_BACKEND 创建并缓存存储实例
+    :param base_url: 本地存储的访问前缀（通常为 SERVER_DOMAIN/static）
+    """
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        else:
+            _storage = LocalStorage(base_url=base_url)
+    return _storage
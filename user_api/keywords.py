@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import Counter
+from typing import List, Optional
+
+try:
+    import jieba
+    import jieba.analyse
+except ImportError:  # 未安装jieba时中文退化为字符n-gram统计
+    jieba = None
+
+# 1. 关键词提取配置
+KEYWORDS_MODE = os.getenv("KEYWORDS_MODE", "local")  # local：本地提取；llm：由大模型返回
+KEYWORDS_TOP_K = int(os.getenv("KEYWORDS_TOP_K", "5"))
+# 本地模式下按该比例抽样请求改由大模型返回关键词，写入翻译记忆作为 benchmark 的参考答案
+KEYWORDS_REFERENCE_RATE = float(os.getenv("KEYWORDS_REFERENCE_RATE", "0"))
+
+_CJK = re.compile(r"[一-鿿]")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_EN_WORD = re.compile(r"[A-Za-z][A-Za-z'\-]+")
+
+ZH_STOPWORDS = set("""
+我们 你们 他们 她们 它们 这个 那个 这些 那些 这里 那里 什么 怎么 为什么 因为 所以 但是 而且 如果 虽然 然后 还是 或者
+已经 可以 没有 一个 一些 自己 就是 不是 这样 那样 还有 以及 进行 需要 时候 现在 非常 比较 可能 应该 其中 之后 之前
+""".split())
+
+ZH_FUNCTION_CHARS = set("的了是在我你他她它们很有和就也都这那个吧吗呢啊着过把被让给从对而与及或之其")
+
+
+def is_chinese(text: str) -> bool:
+    letters = len(_EN_WORD.findall(text))
+    return len(_CJK.findall(text)) >= max(1, letters)
+
+
+# 2. 中文：jieba分词 + TF-IDF（使用jieba自带的IDF语料统计）
+def _extract_chinese(text: str, top_k: int) -> List[str]:
+    if jieba is not None:
+        tags = jieba.analyse.extract_tags(text, topK=top_k * 3)
+        return [t for t in tags if len(t) > 1 and t not in ZH_STOPWORDS and not t.isdigit()][:top_k]
+
+    # 退化方案：统计不含虚词的二字组合频次，频次相同按出现顺序
+    counts = Counter()
+    first_seen = {}
+    for run in _CJK_RUN.findall(text):
+        for i in range(len(run) - 1):
+            gram = run[i:i + 2]
+            if gram in ZH_STOPWORDS or any(c in ZH_FUNCTION_CHARS for c in gram):
+                continue
+            counts[gram] += 1
+            first_seen.setdefault(gram, len(first_seen))
+    return sorted(counts, key=lambda g: (-counts[g], first_seen[g]))[:top_k]
+
+
+def extract_keywords(text: str, top_k: int = KEYWORDS_TOP_K) -> List[str]:
+    """
+    提取1-top_k个中文关键词（TF-IDF）；接口只返回中文关键词，非中文文本返回空列表
+    """
+    text = text.strip()
+    if not text or not is_chinese(text):
+        return []
+    return _extract_chinese(text, top_k)
+
+
+def is_chinese_lang(target_lang: str) -> bool:
+    lang = target_lang.strip().lower()
+    return "中" in lang or "汉" in lang or lang.startswith(("zh", "chinese"))
+
+
+def chinese_text(source: str, translation: Optional[str] = None) -> Optional[str]:
+    """
+    接口约定返回中文关键词：原文是中文取原文，否则取中文译文；两者都不是中文时返回None
+    """
+    if is_chinese(source):
+        return source
+    if translation and is_chinese(translation):
+        return translation
+    return None
+
+
+def chinese_keywords(source: str, translation: Optional[str] = None, top_k: int = KEYWORDS_TOP_K) -> List[str]:
+    text = chinese_text(source, translation)
+    return extract_keywords(text, top_k) if text else []
+
+
+def warm_up() -> None:
+    # 提前加载jieba词典，避免首个请求多花1秒左右；预加载后fork的worker可直接共享
+    if jieba is not None:
+        jieba.initialize()
+
+
+# 3. 与大模型关键词对比的质量基准
+def benchmark(path: str, top_k: int = KEYWORDS_TOP_K) -> dict:
+    """
+    :param path: 翻译记忆追加日志（每行 [原文, 目标语言, 译文, 关键词]）
+                 只有大模型返回关键词的条目（llm模式或按 KEYWORDS_REFERENCE_RATE 抽样）可作为参考，
+                 其余条目关键词为空会被跳过；与接口一致，从中文原文或中文译文中提取
+    :return: 精确率/召回率/F1（关键词互相包含即视为命中）和平均耗时
+    """
+    warm_up()
+    hits = predicted = expected = 0
+    elapsed = 0.0
+    samples = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                source, _, translation, llm_keywords = json.loads(line)
+            except ValueError:
+                continue
+            text = chinese_text(source, translation)
+            if not llm_keywords or text is None:
+                continue
+            start = time.perf_counter()
+            local_keywords = extract_keywords(text, top_k)
+            elapsed += time.perf_counter() - start
+            samples += 1
+            predicted += len(local_keywords)
+            expected += len(llm_keywords)
+            hits += sum(1 for k in local_keywords if any(k in e or e in k for e in llm_keywords))
+
+    precision = hits / predicted if predicted else 0.0
+    recall = hits / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "samples": samples,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "avg_ms": round(elapsed / samples * 1000, 3) if samples else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地关键词提取与大模型关键词对比")
+    parser.add_argument("path", nargs="?", default="data/translation_memory/append.log",
+                        help="翻译记忆日志路径（大模型关键词作为参考答案）")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.path), ensure_ascii=False, indent=2))
@@ -0,0 +1,146 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+import metrics
+
+# 1. 大模型调用预算与对冲配置
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen-plus")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "qwen-turbo")  # 预算不足时改用的快速模型，留空表示不降级
+LLM_DEFAULT_BUDGET = float(os.getenv("LLM_DEFAULT_BUDGET", "30"))  # 默认截止时间（秒）
+LLM_BUDGETS = {  # 各接口截止时间（秒）
+    "translate": float(os.getenv("LLM_BUDGET_TRANSLATE", "20")),
+    "stable": float(os.getenv("LLM_BUDGET_STABLE", "30")),
+}
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))  # 超过该分位延迟仍未返回时发起对冲请求
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "5"))  # 样本不足时的对冲延迟（秒）
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_MAX_THREADS = int(os.getenv("LLM_MAX_THREADS", "32"))
+# 被放弃（对冲失败方、超时）但仍在执行的请求上限；达到上限后不再发起对冲，保证线程池留给新请求
+LLM_MAX_ABANDONED = int(os.getenv("LLM_MAX_ABANDONED", str(LLM_MAX_THREADS // 4)))
+
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_THREADS, thread_name_prefix="llm")
+_abandoned = 0
+_abandoned_lock = threading.Lock()
+
+metrics.register_gauge("llm.hedge_rate", metrics.ratio("llm.hedges", "llm.calls"))
+metrics.register_gauge("llm.hedge_win_rate", metrics.ratio("llm.hedge_wins", "llm.hedges"))
+metrics.register_gauge("llm.abandoned_in_flight", lambda: _abandoned)
+
+
+# 2. 各接口最近延迟统计
+class LatencyTracker:
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+_trackers: Dict[str, LatencyTracker] = defaultdict(LatencyTracker)
+
+
+def hedge_delay(endpoint: str, budget: float) -> float:
+    delay = _trackers[endpoint].percentile(LLM_HEDGE_PERCENTILE)
+    if delay is None:
+        delay = LLM_HEDGE_INITIAL_DELAY
+    return min(max(delay, LLM_HEDGE_MIN_DELAY), budget * 0.8)
+
+
+def _submit(func: Callable, prompt: str, model: str, endpoint: str):
+    started = time.monotonic()
+    # 每个请求复制一份上下文，保证链路追踪Span挂在当前请求下
+    future = _executor.submit(contextvars.copy_context().run, func, prompt, model)
+    if model == LLM_MODEL:
+        # 包括被放弃的请求在内都记录延迟，避免对冲导致分位统计偏小
+        def record(f):
+            if not f.cancelled() and f.exception() is None:
+                _trackers[endpoint].record(time.monotonic() - started)
+        future.add_done_callback(record)
+    return future
+
+
+def _abandon(futures) -> None:
+    """
+    放弃尚未返回的请求：未开始的直接取消；已发出的Dashscope同步调用无法中断，计入在途数直到其结束
+    """
+    global _abandoned
+    for future in futures:
+        if future.cancel():
+            continue
+        with _abandoned_lock:
+            _abandoned += 1
+        future.add_done_callback(_release_abandoned)
+
+
+def _release_abandoned(_future) -> None:
+    global _abandoned
+    with _abandoned_lock:
+        _abandoned -= 1
+
+
+# 3. 带截止时间的对冲调用
+def call(func: Callable[[str, str], dict], prompt: str, endpoint: str = "default",
+         budget: Optional[float] = None) -> dict:
+    """
+    先发主请求；超过分位延迟仍未返回时再发一个对冲请求，取先返回的结果
+    剩余预算不足以等待主模型时，对冲请求改用快速模型
+    :param func: 实际调用函数 (prompt, model) -> dict
+    :param endpoint: 接口名，用于区分预算与延迟统计
+    """
+    budget = budget or LLM_BUDGETS.get(endpoint, LLM_DEFAULT_BUDGET)
+    deadline = time.monotonic() + budget
+    metrics.inc("llm.calls")
+
+    futures = {_submit(func, prompt, LLM_MODEL, endpoint): "primary"}
+    done, _ = wait(futures, timeout=hedge_delay(endpoint, budget))
+
+    if not done and LLM_HEDGE_ENABLED and _abandoned >= LLM_MAX_ABANDONED:
+        metrics.inc("llm.hedges_skipped")  # 被放弃的请求过多，不再对冲以免占满线程池
+    elif not done and LLM_HEDGE_ENABLED:
+        remaining = deadline - time.monotonic()
+        typical = _trackers[endpoint].percentile(50)
+        use_fallback = bool(LLM_FALLBACK_MODEL) and typical is not None and typical > remaining
+        kind = "fallback" if use_fallback else "hedge"
+        futures[_submit(func, prompt, LLM_FALLBACK_MODEL if use_fallback else LLM_MODEL, endpoint)] = kind
+        metrics.inc("llm.hedges")
+        if use_fallback:
+            metrics.inc("llm.fallbacks")
+
+    last_error = None
+    while futures:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            kind = futures.pop(future)
+            if future.exception() is not None:
+                last_error = future.exception()
+                continue
+            # 取消尚未开始的请求；已发出的请求无法中断，结果直接丢弃
+            _abandon(futures)
+            if kind != "primary":
+                metrics.inc("llm.hedge_wins")
+            return future.result()
+
+    if futures:
+        _abandon(futures)
+        metrics.inc("llm.timeouts")
+        raise TimeoutError(f"大模型调用超过截止时间（{budget}秒）")
+    raise last_error
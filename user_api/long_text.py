@@ -0,0 +1,102 @@
+import asyncio
+import os
+import re
+from collections import Counter
+from typing import Callable, List, Tuple
+
+# 1. 长文本翻译配置
+LONG_TEXT_THRESHOLD = int(os.getenv("LONG_TEXT_THRESHOLD", "800"))  # 超过该字符数启用分块翻译
+LONG_TEXT_CHUNK_CHARS = int(os.getenv("LONG_TEXT_CHUNK_CHARS", "500"))  # 每块最大字符数
+LONG_TEXT_CONCURRENCY = int(os.getenv("LONG_TEXT_CONCURRENCY", "4"))  # 同一请求最多并发翻译的块数
+LONG_TEXT_MAX_KEYWORDS = int(os.getenv("LONG_TEXT_MAX_KEYWORDS", "5"))
+
+# 译文不需要用空格连接句子的目标语言
+NO_SPACE_LANGS = {"中文", "简体中文", "繁体中文", "日文", "日语", "chinese", "japanese", "zh", "ja"}
+
+_PARAGRAPH = re.compile(r"(\n\s*)")
+_SENTENCE = re.compile(r"(?<=[。！？!?；;…])|(?<=\.)(?=\s)")
+
+
+# 2. 按段落/句子切分
+def _split_sentences(paragraph: str, max_chars: int) -> List[str]:
+    sentences = []
+    for sentence in _SENTENCE.split(paragraph):
+        if not sentence:
+            continue
+        # 单句超长时按最大长度硬切
+        while len(sentence) > max_chars:
+            sentences.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        sentences.append(sentence)
+    return sentences
+
+
+def split_chunks(text: str, max_chars: int = LONG_TEXT_CHUNK_CHARS) -> List[Tuple[str, str]]:
+    """
+    在段落和句子边界切分长文本，把相邻的句子和段落合并到max_chars以内
+    块内段落之间的换行保留在块文本中，由大模型一并翻译
+    :return: [(块文本, 块后的分隔符)]，分隔符为原文中的换行（段落边界）或空串（段内边界）
+    """
+    # 先展开为 (句子, 句后分隔符)，段落最后一句带上段落分隔符
+    units: List[List[str]] = []
+    parts = _PARAGRAPH.split(text)
+    for i in range(0, len(parts), 2):
+        separator = parts[i + 1] if i + 1 < len(parts) else ""
+        sentences = [s for s in _split_sentences(parts[i], max_chars) if s.strip()]
+        if not sentences:
+            if units:  # 空段落：把分隔符并到上一句
+                units[-1][1] += separator
+            continue
+        units.extend([sentence, ""] for sentence in sentences)
+        units[-1][1] = separator
+
+    chunks = []
+    current, pending = "", ""
+    for sentence, separator in units:
+        if current and len(current) + len(pending) + len(sentence) > max_chars:
+            chunks.append((current.strip(), pending))
+            current, pending = "", ""
+        current += pending + sentence
+        pending = separator
+    if current.strip():
+        chunks.append((current.strip(), pending))
+    return chunks
+
+
+def merge_keywords(keyword_lists: List[List[str]], limit: int = LONG_TEXT_MAX_KEYWORDS) -> List[str]:
+    """
+    合并各块关键词：去重，按出现块数降序、首次出现顺序排列
+    """
+    counts = Counter()
+    first_seen = {}
+    for keywords in keyword_lists:
+        for keyword in dict.fromkeys(k.strip() for k in keywords if k and k.strip()):
+            counts[keyword] += 1
+            first_seen.setdefault(keyword, len(first_seen))
+    ranked = sorted(counts, key=lambda k: (-counts[k], first_seen[k]))
+    return ranked[:limit]
+
+
+# 3. 分块并发翻译
+async def translate_long(text: str, target_lang: str,
+                         translate_segment: Callable[[str, str], Tuple[str, List[str]]],
+                         concurrency: int = LONG_TEXT_CONCURRENCY) -> Tuple[str, List[str]]:
+    """
+    :param translate_segment: 同步翻译函数 (文本, 目标语言) -> (译文, 关键词)，在线程池中执行
+    :return: 按原顺序拼接的译文 + 合并后的关键词
+    """
+    chunks = split_chunks(text)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: str):
+        async with semaphore:
+            return await asyncio.to_thread(translate_segment, chunk, target_lang)
+
+    results = await asyncio.gather(*(run(chunk) for chunk, _ in chunks))
+
+    joiner = "" if target_lang.strip().lower() in NO_SPACE_LANGS else " "
+    pieces = []
+    for (_, separator), (translation, _) in zip(chunks, results):
+        pieces.append(translation.strip())
+        pieces.append(separator or joiner)
+    return "".join(pieces).strip(), merge_keywords([keywords for _, keywords in results])
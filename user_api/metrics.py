@@ -0,0 +1,40 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+# 进程内指标：计数器 + 按需计算的派生指标（每个worker进程各自统计）
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def register_gauge(name: str, func: Callable[[], float]) -> None:
+    """
+    注册派生指标，如命中率，在读取时计算
+    """
+    _gauges[name] = func
+
+
+def ratio(numerator: str, denominator: str) -> Callable[[], float]:
+    def compute():
+        total = get(denominator)
+        return round(get(numerator) / total, 4) if total else 0.0
+    return compute
+
+
+def snapshot() -> Dict[str, float]:
+    with _lock:
+        data = dict(_counters)
+    for name, func in _gauges.items():
+        data[name] = func()
+    return dict(sorted(data.items()))
@@ -0,0 +1,226 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+# 1. 采样分析配置（默认关闭，需显式开启）
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))  # 采样间隔（秒），默认100Hz
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "60"))
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")  # 请求头 X-Debug-Profile 需携带该值才会对单个请求采样
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
+PROFILE_HEADER = "X-Debug-Profile"
+PROFILER_INCLUDE_IDLE = os.getenv("PROFILER_INCLUDE_IDLE", "0") == "1"  # 是否记录空闲等待中的线程
+
+# 栈顶为以下函数时视为空闲线程（线程池等任务、Event/Condition等待、事件循环无事件），默认不记录
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),  # concurrent.futures线程池在C层 work_queue.get() 上等待
+    ("selectors.py", "select"),  # asyncio默认事件循环
+    # uvloop的事件循环整个在C代码中运行，等待事件时栈顶是启动事件循环的Python函数；
+    # 执行回调/协程时栈顶是协程自身的帧，这些函数位于其下方，不会被误判为空闲
+    ("runners.py", "run"),  # asyncio.run（uvicorn在Python 3.11+下的启动方式）
+    ("server.py", "run"),  # uvicorn Server.run 直接调用 run_until_complete
+    ("workers.py", "run"),  # gunicorn的UvicornWorker
+}
+
+# 同一进程同一时间只运行一个采样器，控制开销
+_active_lock = threading.Lock()
+
+
+# 2. 采样结果
+class Profile:
+    def __init__(self, stacks: Dict[str, int], interval: float, duration: float, overhead: float, ticks: int = 0):
+        """
+        :param stacks: 折叠栈（"线程;函数1;函数2"）-> 采样次数
+        :param overhead: 采样线程自身消耗的CPU时间（秒）
+        :param ticks: 实际采样轮数；GIL竞争、定时精度会使实际频率低于 1/interval
+        """
+        self.stacks = stacks
+        self.interval = interval
+        self.duration = duration
+        self.overhead = overhead
+        self.ticks = ticks
+
+    @property
+    def seconds_per_sample(self) -> float:
+        # 按实测时长/采样轮数折算每次采样代表的时间，而不是名义间隔
+        return self.duration / self.ticks if self.ticks else self.interval
+
+    def to_collapsed(self) -> str:
+        # 兼容 flamegraph.pl / speedscope 的折叠栈文本格式
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def to_speedscope(self, name: str = "profile") -> dict:
+        frames, frame_index, samples, weights = [], {}, [], []
+        seconds = self.seconds_per_sample
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack.split(";"):
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame})
+                sample.append(frame_index[frame])
+            samples.append(sample)
+            weights.append(count * seconds)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": name, "unit": "seconds",
+                "startValue": 0, "endValue": round(sum(weights), 6),
+                "samples": samples, "weights": weights,
+            }],
+            "name": name,
+            "activeProfileIndex": 0,
+            "exporter": "user_api.profiler",
+        }
+
+    def to_dict(self) -> dict:
+        return {"interval": self.interval, "duration": self.duration, "ticks": self.ticks,
+                "overhead_cpu_seconds": self.overhead, "stacks": self.stacks}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Profile":
+        return cls(data["stacks"], data["interval"], data["duration"], data.get("overhead_cpu_seconds", 0),
+                   data.get("ticks", 0))
+
+
+# 3. 采样器：后台线程定时抓取所有线程（事件循环+线程池）的调用栈
+class _CodeInfo:
+    __slots__ = ("name", "idle")
+
+    def __init__(self, code):
+        filename = os.path.basename(code.co_filename)
+        self.name = f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{code.co_firstlineno})"
+        self.idle = (filename, code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILER_INTERVAL, include_idle: bool = PROFILER_INCLUDE_IDLE):
+        self.interval = interval
+        self.include_idle = include_idle
+        # 采样时只记录帧名元组，结束后再拼接为折叠栈字符串
+        self.counts: Counter = Counter()
+        self.idle_samples = 0
+        self._codes: Dict[object, _CodeInfo] = {}  # 每个代码对象只格式化一次帧名
+        self._thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._overhead = 0.0
+        self._ticks = 0
+        self._elapsed = 0.0  # 采样线程从开始到结束的时长，与 _ticks 对应
+
+    def start(self) -> bool:
+        """
+        :return: 已有采样器在运行时返回False
+        """
+        if not _active_lock.acquire(blocking=False):
+            return False
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _info(self, code) -> _CodeInfo:
+        info = self._codes.get(code)
+        if info is None:
+            info = self._codes[code] = _CodeInfo(code)
+        return info
+
+    def _thread_name(self, thread_id: int) -> str:
+        name = self._thread_names.get(thread_id)
+        if name is None:  # 新线程才重新枚举
+            self._thread_names = {t.ident: t.name for t in threading.enumerate()}
+            name = self._thread_names.setdefault(thread_id, f"thread-{thread_id}")
+        return name
+
+    def _sample(self, own_id: int) -> None:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            info = self._info(frame.f_code)
+            if info.idle and not self.include_idle:
+                self.idle_samples += 1
+                continue
+            stack = [info.name]
+            frame = frame.f_back
+            while frame is not None:
+                stack.append(self._info(frame.f_code).name)
+                frame = frame.f_back
+            stack.append(self._thread_name(thread_id))
+            self.counts[tuple(stack)] += 1
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        cpu_start = time.thread_time()
+        wall_start = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self._sample(own_id)
+            self._ticks += 1
+        self._elapsed = time.monotonic() - wall_start
+        self._overhead = time.thread_time() - cpu_start
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            _active_lock.release()
+        stacks: Dict[str, int] = {";".join(reversed(stack)): count for stack, count in self.counts.items()}
+        # 有采样时用采样线程自身的时长，使 duration/ticks 恰为每次采样代表的时间
+        duration = self._elapsed if self._ticks else time.monotonic() - self._started
+        return Profile(stacks, self.interval, round(duration, 3), round(self._overhead, 4), self._ticks)
+
+
+# 4. 单请求采样结果的保存/读取
+def save_profile(profile: Profile, profile_id: Optional[str] = None) -> str:
+    profile_id = profile_id or uuid.uuid4().hex
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(profile.to_dict(), f, ensure_ascii=False)
+    return profile_id
+
+
+def load_profile(profile_id: str) -> Optional[Profile]:
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return Profile.from_dict(json.load(f))
+
+
+# 5. ASGI中间件：携带 X-Debug-Profile: <PROFILER_TOKEN> 的请求在处理期间采样，结果ID通过 X-Profile-Id 返回
+class ProfileMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILER_ENABLED or not PROFILER_TOKEN:
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers", []))
+        if headers.get(PROFILE_HEADER.lower().encode("latin-1"), b"").decode("latin-1") != PROFILER_TOKEN:
+            return await self.app(scope, receive, send)
+
+        sampler = SamplingProfiler()
+        if not sampler.start():
+            return await self.app(scope, receive, send)  # 已有采样在进行，本次不采样
+        profile_id = uuid.uuid4().hex
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            save_profile(sampler.stop(), profile_id)
@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    import jieba
+except ImportError:  # 未安装jieba时中文按单字+二字切分
+    jieba = None
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，退化为进程内锁
+    fcntl = None
+
+# 1. 检索配置：每个用户一个SQLite FTS5索引文件，按邮箱哈希分片存放
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "data/search")
+SEARCH_FIELDS = ("prompt", "negative_prompt", "style", "model")
+# 按相关度排序时只对最新的N条匹配计算BM25并排序，匹配数很大时耗时仍有上限（按时间排序不受影响）
+SEARCH_RELEVANCE_LIMIT = int(os.getenv("SEARCH_RELEVANCE_LIMIT", "1000"))
+SCHEMA_VERSION = 2  # 写入 PRAGMA user_version，表示索引已完整建立；版本不符时重建
+
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_TOKEN = re.compile(r"[一-鿿]+|[A-Za-z0-9][A-Za-z0-9_\-]*")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    record_id TEXT UNIQUE NOT NULL,
+    source TEXT NOT NULL,          -- storage：新版存储Key；legacy：旧版静态文件路径
+    location TEXT NOT NULL,
+    date REAL NOT NULL,
+    prompt TEXT, negative_prompt TEXT, style TEXT, model TEXT,
+    thumbnails TEXT                -- {尺寸: 存储Key或旧版文件路径}，JSON
+);
+CREATE INDEX IF NOT EXISTS idx_images_date ON images(date);
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    prompt, negative_prompt, style, model, content='', tokenize='porter unicode61'
+);
+"""
+
+
+# 2. 中英文分词：中文用jieba搜索模式（或单字+二字），英文交给FTS5的porter词干化
+def tokenize(text: Optional[str]) -> List[str]:
+    tokens = []
+    for piece in _TOKEN.findall((text or "").lower()):
+        if not _CJK_RUN.fullmatch(piece):
+            tokens.append(piece)
+        elif jieba is not None:
+            tokens.extend(t for t in jieba.cut_for_search(piece) if t.strip())
+        else:
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+def _query_tokens(text: str) -> List[str]:
+    tokens = []
+    for piece in _TOKEN.findall(text.lower()):
+        if _CJK_RUN.fullmatch(piece) and len(piece) > 2 and jieba is None:
+            # 查询词按二字切分，与索引中的二字词逐一匹配
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        elif _CJK_RUN.fullmatch(piece) and jieba is not None:
+            tokens.extend(t for t in jieba.cut(piece) if t.strip())
+        else:
+            tokens.append(piece)
+    return list(dict.fromkeys(tokens))
+
+
+def build_match(query: str, field: str = "all") -> Optional[str]:
+    """
+    生成FTS5查询表达式：所有词必须同时命中（AND），可限定字段
+    """
+    tokens = _query_tokens(query)
+    if not tokens:
+        return None
+    expression = " ".join('"' + t.replace('"', '""') + '"' for t in tokens)
+    if field in SEARCH_FIELDS:
+        return f"{{{field}}} : ({expression})"
+    return expression
+
+
+# 3. 索引读写
+def user_digest(email: str) -> str:
+    # 与 image_storage.user_prefix 使用相同的哈希，可由记录Key反查索引文件
+    return hashlib.sha1(email.strip().lower().encode("utf-8")).hexdigest()
+
+
+def index_path(email: str) -> str:
+    return _digest_path(user_digest(email))
+
+
+def _digest_path(digest: str) -> str:
+    return os.path.join(SEARCH_INDEX_DIR, digest[:2], f"{digest}.db")
+
+
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _write_lock(path: str):
+    """
+    同一用户索引的写入（全量构建、增量添加、缩略图更新）跨worker进程串行执行
+    """
+    if fcntl is None:
+        with _thread_lock:
+            yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _is_ready(path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    with closing(sqlite3.connect(path, timeout=5)) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    created = not os.path.exists(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    if created:
+        conn.execute("PRAGMA journal_mode=WAL")  # 多worker并发读写，设置后持久生效
+        conn.executescript(_SCHEMA)
+    return conn
+
+
+def _insert(conn: sqlite3.Connection, record: dict, source: str, location: str) -> None:
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO images(record_id, source, location, date, prompt, negative_prompt, style, model, "
+        "thumbnails) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (record["id"], source, location, record.get("date", 0),
+         record.get("prompt"), record.get("negative_prompt"), record.get("style"), record.get("model"),
+         json.dumps(record.get("thumbnails") or {})))
+    if cursor.rowcount:
+        conn.execute(
+            "INSERT INTO images_fts(rowid, prompt, negative_prompt, style, model) VALUES (?, ?, ?, ?, ?)",
+            (cursor.lastrowid, *(" ".join(tokenize(record.get(f))) for f in SEARCH_FIELDS)))
+
+
+def add(email: str, record: dict, source: str = "storage", location: Optional[str] = None) -> None:
+    """
+    生成图片后增量写入索引
+    :param record: image_storage中的用户记录（id、key、prompt、negative_prompt、style、model、date）
+    """
+    path = index_path(email)
+    # 在锁内判断：构建中的索引会等构建结束后再写入；尚未建立索引的用户在首次搜索时全量构建，包含这条记录
+    with _write_lock(path):
+        if not os.path.exists(path):
+            return
+        with closing(_connect(path)) as conn, conn:
+            _insert(conn, record, source, location or record["key"])
+
+
+def update_thumbnails(record_key: str, thumbnails: Dict[str, str]) -> None:
+    """
+    后台生成缩略图后写回索引
+    :param record_key: image_storage中的记录Key，users/ab/<用户哈希>/records/<月份>/<id>.json
+    """
+    parts = record_key.split("/")
+    path = _digest_path(parts[2])
+    record_id = os.path.splitext(parts[-1])[0]
+    with _write_lock(path):
+        if not os.path.exists(path):
+            return  # 之后全量构建时从记录中读取
+        with closing(_connect(path)) as conn, conn:
+            conn.execute("UPDATE images SET thumbnails = ? WHERE record_id = ?", (json.dumps(thumbnails), record_id))
+
+
+def rebuild(email: str, load_records: Callable[[], Iterable[dict]],
+            load_legacy: Callable[[], Iterable[dict]] = lambda: (), force: bool = False) -> int:
+    """
+    全量构建用户索引（首次搜索或历史数据补建时使用）
+    在锁内原地写入（INSERT OR IGNORE），不替换文件；并发的首次搜索只有一个执行构建，其余等待后直接返回
+    :param load_records: 返回用户记录，在锁内调用，构建期间新保存的记录由 add() 在构建结束后补写
+    :param load_legacy: 返回旧版图库条目，需包含 id、path、提示词字段及 thumbnails
+    :param force: 已建立的索引也清空重建
+    :return: 写入的条目数，索引已由其他请求建立时返回0
+    """
+    path = index_path(email)
+    with _write_lock(path):
+        ready = _is_ready(path)
+        if ready and not force:
+            return 0
+        if not ready:
+            # 构建中断或旧版本的索引：搜索只读取已建好的索引，此时只有持锁方会打开它，可以安全删除
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        count = 0
+        items = [(record, "storage", record["key"]) for record in load_records()
+                 if record.get("id") and record.get("key")]
+        items.extend((item, "legacy", item["path"]) for item in load_legacy())
+        # 按时间正序写入，使rowid顺序与时间一致，按时间排序时可直接倒序扫描
+        items.sort(key=lambda x: x[0].get("date", 0))
+        with closing(_connect(path)) as conn:
+            with conn:
+                if ready:  # force：在同一事务中清空并重写，读取方仍看到旧数据直到提交
+                    conn.execute("DELETE FROM images")
+                    conn.execute("INSERT INTO images_fts(images_fts) VALUES ('delete-all')")
+                for record, source, location in items:
+                    _insert(conn, record, source, location)
+                    count += 1
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return count
+
+
+def exists(email: str) -> bool:
+    """
+    索引已完整建立（构建中或旧版本的索引返回False）
+    """
+    return _is_ready(index_path(email))
+
+
+def search(email: str, query: str, field: str = "all", sort: str = "date",
+           page: int = 1, page_size: int = 20) -> dict:
+    """
+    :param sort: date（最新在前，默认）或 relevance（在最新的 SEARCH_RELEVANCE_LIMIT 条匹配中按BM25相关度排序）
+    :return: {"total": 总数, "items": 当前页记录}
+    """
+    match = build_match(query, field)
+    if match is None:
+        return {"total": 0, "items": []}
+    with closing(_connect(index_path(email))) as conn:
+        total = conn.execute("SELECT count(*) FROM images_fts WHERE images_fts MATCH ?", (match,)).fetchone()[0]
+        if sort == "date":
+            rows = conn.execute(
+                "SELECT i.* FROM images_fts JOIN images i ON i.id = images_fts.rowid "
+                "WHERE images_fts MATCH ? ORDER BY images_fts.rowid DESC LIMIT ? OFFSET ?",
+                (match, page_size, (page - 1) * page_size)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT i.* FROM (SELECT rowid, bm25(images_fts) AS score FROM images_fts "
+                "WHERE images_fts MATCH ? ORDER BY rowid DESC LIMIT ?) m JOIN images i ON i.id = m.rowid "
+                "ORDER BY m.score, m.rowid DESC LIMIT ? OFFSET ?",
+                (match, SEARCH_RELEVANCE_LIMIT, page_size, (page - 1) * page_size)).fetchall()
+    return {"total": total, "items": [dict(row) for row in rows]}
+
+
+if __name__ == "__main__":
+    import image_storage
+
+    parser = argparse.ArgumentParser(description="重建用户图片提示词索引")
+    parser.add_argument("email", help="用户邮箱")
+    args = parser.parse_args()
+    count = rebuild(args.email, lambda: image_storage.get_storage().list_records(args.email), force=True)
+    print(f"✅ 已索引 {count} 张图片")
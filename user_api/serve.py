@@ -0,0 +1,101 @@
+import argparse
+import multiprocessing
+import os
+
+# 1. 启动配置（命令行参数优先，其次环境变量）
+APP_URI = "fastapi_user:app"
+DEFAULT_HOST = os.getenv("HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.getenv("PORT", "8000"))
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+DEFAULT_MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "1000"))  # 每个worker处理N个请求后重启，0表示不限
+DEFAULT_MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "100"))  # 随机抖动，避免所有worker同时重启
+DEFAULT_GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "180"))  # 退出前等待进行中的生成请求完成（秒）
+DEFAULT_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "120"))  # worker失去响应多久后被重启（秒）
+
+
+def _worker_class() -> str:
+    # uvicorn新版本将Gunicorn worker拆分到 uvicorn-worker 包中
+    try:
+        import uvicorn_worker  # noqa: F401
+        return "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        return "uvicorn.workers.UvicornWorker"
+
+
+def _post_fork(server, worker):
+    # 预加载时主进程已创建数据库连接池，子进程需丢弃继承的连接
+    import fastapi_user
+    fastapi_user.engine.dispose(close=False)
+
+
+# 2. Gunicorn方式启动（Linux生产环境）：预加载应用+共享监听端口+多worker
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from gunicorn.util import import_app
+            return import_app(APP_URI)
+
+    Application({
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": _worker_class(),
+        "preload_app": True,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.timeout,
+        "keepalive": 5,
+        "post_fork": _post_fork,
+    }).run()
+
+
+# 3. 纯uvicorn方式启动（Windows或未安装gunicorn时）
+def run_uvicorn(args):
+    import uvicorn
+
+    uvicorn.run(
+        APP_URI,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="auto",  # 已安装uvloop时自动使用
+        http="auto",  # 已安装httptools时自动使用
+        limit_max_requests=args.max_requests or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程启动用户接口服务")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker进程数")
+    parser.add_argument("--max-requests", type=int, default=DEFAULT_MAX_REQUESTS, help="worker处理多少请求后重启")
+    parser.add_argument("--max-requests-jitter", type=int, default=DEFAULT_MAX_REQUESTS_JITTER, help="重启阈值随机抖动")
+    parser.add_argument("--graceful-timeout", type=int, default=DEFAULT_GRACEFUL_TIMEOUT, help="优雅退出等待时间（秒）")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="worker无响应超时（秒）")
+    args = parser.parse_args(argv)
+
+    try:
+        if os.name == "nt":
+            raise ImportError("gunicorn不支持Windows")
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("⚠️ 未安装gunicorn（或当前为Windows），使用uvicorn多进程模式启动")
+        run_uvicorn(args)
+        return
+    run_gunicorn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,27 @@ import json
 import base64
 import os
 import random
+import threading
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from io import BytesIO
 from datetime import datetime
+from typing import Optional
+
+import tracing
 
 # 1. 配置SD API基础地址（秋叶包默认）
 SD_API_URL = "http://127.0.0.1:7860/sdapi/v1/txt2img"
+SD_INTERRUPT_URL = "http://127.0.0.1:7860/sdapi/v1/interrupt"  # 中断当前渲染
+SD_PROGRESS_URL = "http://127.0.0.1:7860/internal/progress"  # 查询指定任务是否正在渲染
+# 进度达到该比例时不再中断：进度查询和中断是两次请求，任务即将结束时中断可能落到下一个任务上
+SD_INTERRUPT_MAX_PROGRESS = float(os.getenv("SD_INTERRUPT_MAX_PROGRESS", "0.9"))
+# 渲染专用线程池：每次渲染占用线程直到SD返回（数十秒），不与默认线程池中的中断轮询、大模型调用等争抢线程
+SD_RENDER_THREADS = int(os.getenv("SD_RENDER_THREADS", "4"))
+
+render_executor = ThreadPoolExecutor(max_workers=SD_RENDER_THREADS, thread_name_prefix="sd-render")
 
 # 2. 预定义支持的模型列表
 SUPPORTED_MODELS = [
@@ -90,6 +105,52 @@ def get_unique_filename(base_dir: str = "static/avatar", ext: str = "png") -> st
     return full_path
 
 
+# 渲染耗时统计（指数滑动平均），用于估算取消请求节省的GPU时间
+_render_lock = threading.Lock()
+_avg_render_seconds = None
+
+
+def record_render_seconds(seconds: float) -> None:
+    global _avg_render_seconds
+    with _render_lock:
+        _avg_render_seconds = seconds if _avg_render_seconds is None else 0.8 * _avg_render_seconds + 0.2 * seconds
+
+
+def average_render_seconds(default: float = 10.0) -> float:
+    return _avg_render_seconds if _avg_render_seconds is not None else default
+
+
+def new_task_id() -> str:
+    return f"task({uuid.uuid4().hex[:15]})"
+
+
+def interrupt(task_id: str = None) -> Optional[float]:
+    """
+    中断SD当前渲染（阻塞调用，异步代码中需放到线程执行）
+    传入task_id时先确认该任务正在渲染，避免误中断其他用户的任务
+    确认与中断是两次请求，只能尽量避免：进度已超过 SD_INTERRUPT_MAX_PROGRESS 时不中断，等待任务自然结束
+    :return: 发出中断时返回该任务已完成的进度（0~1，未知时为0）；
+             任务未在渲染（排队中或已结束）、即将完成或请求失败时返回None
+    """
+    progress = 0.0
+    try:
+        if task_id:
+            response = requests.post(SD_PROGRESS_URL, json={"id_task": task_id, "id_live_preview": -1}, timeout=2)
+            if response.ok:
+                state = response.json()
+                if not state.get("active", False):
+                    return None
+                progress = float(state.get("progress") or 0.0)
+                if progress >= SD_INTERRUPT_MAX_PROGRESS:
+                    return None
+        requests.post(SD_INTERRUPT_URL, timeout=2).raise_for_status()
+        print(f"⏹️ 已中断SD渲染：{task_id}")
+        return progress
+    except requests.exceptions.RequestException as e:
+        print(f"❌ 中断SD渲染失败：{e}")
+        return None
+
+
 # 4. 核心生成函数（支持传参+防覆盖）
 def generate_image_by_qiuye(
         prompt: str = "a beautiful sunset over the mountains, 8k, high detail, realistic",
@@ -101,7 +162,11 @@ def generate_image_by_qiuye(
         cfg_scale: float = 7.5,
         sampler_index: str = "DPM++ 2M Karras",
         save_dir: str = "static/avatar",  # 仅指定保存目录，文件名自动生成
-        save_ext: str = "png"  # 文件格式
+        save_ext: str = "png",  # 文件格式
+        storage=None,  # 可选：image_storage存储后端，传入后按内容寻址保存
+        task_id: str = None,  # 可选：SD任务ID，用于中断时确认任务
+        cancel_event: threading.Event = None,  # 可选：请求取消后置位，渲染结果直接丢弃
+        saved: dict = None  # 可选：保存到存储后写入 size、crc32，供图库导出使用
 ):
     """
     调用秋叶SD API生成图片（防覆盖+支持传参）
@@ -115,8 +180,12 @@ def generate_image_by_qiuye(
     :param sampler_index: 采样器（默认DPM++ 2M Karras）
     :param save_dir: 保存目录（默认static/avatar），文件名自动生成唯一值
     :param save_ext: 文件后缀（默认png）
+    :param storage: 存储后端（image_storage.BaseStorage），传入时忽略save_dir，返回存储Key
+    :param task_id: SD任务ID（force_task_id），配合interrupt使用
+    :param cancel_event: 取消标记，置位后不再保存图片
+    :param saved: 传入空字典时，保存成功后写入文件大小(size)和CRC32(crc32)，避免之后重新读取
     其他参数同前
-    :return: 生成的PIL.Image对象 + 保存路径（失败返回None, None）
+    :return: 生成的PIL.Image对象 + 保存路径/存储Key（失败返回None, None）
     """
     # 校验模型名称
     if model_name not in SUPPORTED_MODELS:
@@ -135,16 +204,23 @@ def generate_image_by_qiuye(
         "return_images": True,
         "sd_model_checkpoint": model_name
     }
+    if task_id:
+        payload["force_task_id"] = task_id
 
     try:
-        # 发送请求
-        response = requests.post(
-            url=SD_API_URL,
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(payload)
-        )
-        response.raise_for_status()
-        result = response.json()
+        # 发送请求（含模型切换+txt2img耗时）
+        with tracing.span("sd.txt2img", model=model_name, steps=steps, width=width, height=height):
+            response = requests.post(
+                url=SD_API_URL,
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(payload)
+            )
+            response.raise_for_status()
+            result = response.json()
+
+        if cancel_event is not None and cancel_event.is_set():
+            print("⚠️ 请求已取消，丢弃本次渲染结果")
+            return None, None
 
         # 检查API错误
         if "error" in result:
@@ -152,20 +228,38 @@ def generate_image_by_qiuye(
             return None, None
 
         # 解码图片数据
-        image_data_str = result["images"][0].strip().replace("\n", "")
-        try:
-            image_bytes = bytes.fromhex(image_data_str)
-            print("✅ 使用Hex编码解码")
-        except ValueError:
-            image_bytes = base64.b64decode(image_data_str)
-            print("✅ 使用Base64编码解码")
+        with tracing.span("sd.decode"):
+            image_data_str = result["images"][0].strip().replace("\n", "")
+            try:
+                image_bytes = bytes.fromhex(image_data_str)
+                print("✅ 使用Hex编码解码")
+            except ValueError:
+                image_bytes = base64.b64decode(image_data_str)
+                print("✅ 使用Base64编码解码")
+
+            image = Image.open(BytesIO(image_bytes))
+
+        if storage is not None:
+            # 按内容哈希保存（相同图片只存一份）
+            with tracing.span("image.encode", format=save_ext):
+                if image.format and image.format.lower() == save_ext.lower().replace("jpg", "jpeg"):
+                    data = image_bytes
+                else:
+                    buffer = BytesIO()
+                    image.save(buffer, format="JPEG" if save_ext.lower() == "jpg" else save_ext.upper())
+                    data = buffer.getvalue()
+            save_path = storage.save_content(data, save_ext)
+            if saved is not None:
+                saved.update(size=len(data), crc32=zlib.crc32(data))
+            print(f"✅ 图片生成成功！存储Key：{save_path}")
+            return image, save_path
 
         # 生成唯一保存路径（核心：防覆盖）
         save_path = get_unique_filename(base_dir=save_dir, ext=save_ext)
 
         # 保存图片
-        image = Image.open(BytesIO(image_bytes))
-        image.save(save_path)
+        with tracing.span("image.save", path=save_path):
+            image.save(save_path)
         print(f"✅ 图片生成成功！唯一保存路径：{save_path}")
 
         return image, save_path  # 返回图片对象+保存路径
@@ -0,0 +1,199 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from typing import Dict, Optional
+
+from PIL import Image
+
+import image_storage
+import search_index
+
+# 1. 缩略图配置
+THUMBNAIL_SIZES = [int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,256").split(",")]
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+LEGACY_GALLERY_ROOT = "static"  # 旧版平铺图库 static/{邮箱用户名}
+LEGACY_SKIP_DIRS = {"images", "thumbs", "users", "avatar"}  # 新版存储使用的目录，不属于旧版图库
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()  # 提交任务在线程池中执行，防止并发创建多个进程池
+
+
+# 2. 缩略图Key：由原图Key推导，images/ab/cd/<sha>.png -> thumbs/256/ab/cd/<sha>.webp
+def thumbnail_key(key: str, size: int) -> str:
+    parts = key.split("/")
+    name = os.path.splitext(parts[-1])[0]
+    return "/".join([f"thumbs/{size}"] + parts[1:-1] + [f"{name}.webp"])
+
+
+def legacy_thumbnail_path(image_path: str, size: int) -> str:
+    """
+    旧版图库缩略图路径：static/user/a.png -> static/user/thumbs/256/a.webp
+    """
+    directory, filename = os.path.split(image_path)
+    return os.path.join(directory, "thumbs", str(size), f"{os.path.splitext(filename)[0]}.webp")
+
+
+# 3. 核心处理函数（在工作进程中执行）
+def _open_image(data: bytes) -> Image.Image:
+    image = Image.open(BytesIO(data))
+    image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image
+
+
+def _render(image: Image.Image, size: int) -> bytes:
+    thumb = image.copy()
+    thumb.thumbnail((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    thumb.save(buffer, format="WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def make_thumbnails(key: str, record_key: Optional[str] = None) -> Dict[str, str]:
+    """
+    读取原图并生成多种尺寸的WebP缩略图
+    :param key: 原图存储Key
+    :param record_key: 用户记录Key，传入时把缩略图Key写回记录
+    :return: {尺寸: 缩略图Key}
+    """
+    storage = image_storage.get_storage()
+    image = _open_image(storage.get(key))
+
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        thumb_key = thumbnail_key(key, size)
+        if not storage.exists(thumb_key):
+            storage.put(thumb_key, _render(image, size), image_storage.CONTENT_TYPES["webp"])
+        thumbnails[str(size)] = thumb_key
+
+    if record_key:
+        storage.update_record(record_key, {"thumbnails": thumbnails})
+        search_index.update_thumbnails(record_key, thumbnails)
+    return thumbnails
+
+
+def make_legacy_thumbnails(image_path: str) -> Dict[str, str]:
+    """
+    为旧版平铺目录中的图片生成缩略图（旧版图库始终在本地磁盘）
+    :return: {尺寸: 缩略图文件路径}
+    """
+    image = None
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        thumb_path = legacy_thumbnail_path(image_path, size)
+        if not os.path.exists(thumb_path):
+            if image is None:
+                with open(image_path, "rb") as f:
+                    image = _open_image(f.read())
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_render(image, size))
+            os.replace(tmp_path, thumb_path)
+        thumbnails[str(size)] = thumb_path
+    return thumbnails
+
+
+def legacy_thumbnails(image_path: str) -> Dict[str, str]:
+    """
+    已生成的旧版图库缩略图 {尺寸: 文件路径}，未生成的尺寸不返回
+    """
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        thumb_path = legacy_thumbnail_path(image_path, size)
+        if os.path.exists(thumb_path):
+            thumbnails[str(size)] = thumb_path
+    return thumbnails
+
+
+# 4. 进程池（主进程中懒加载）
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # worker进程中已有链路追踪导出、线程池等线程，fork后子进程可能卡在fork时被占用的锁上，改用spawn启动
+            _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def submit(key: str, record_key: Optional[str] = None):
+    """
+    提交缩略图任务到后台进程，不阻塞请求
+    """
+    future = get_executor().submit(make_thumbnails, key, record_key)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        print(f"❌ 缩略图生成失败：{future.exception()}")
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+# 5. 历史图库补全缩略图
+def list_legacy_images(root: str = LEGACY_GALLERY_ROOT):
+    """
+    遍历旧版平铺图库 static/{邮箱用户名}/ 下的图片（不含子目录）
+    """
+    if not os.path.isdir(root):
+        return
+    for user_dir in sorted(os.listdir(root)):
+        gallery_dir = os.path.join(root, user_dir)
+        if user_dir in LEGACY_SKIP_DIRS or not os.path.isdir(gallery_dir):
+            continue
+        for filename in sorted(os.listdir(gallery_dir)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(gallery_dir, filename)
+
+
+def backfill(workers: int = THUMBNAIL_WORKERS, legacy_root: str = LEGACY_GALLERY_ROOT) -> int:
+    """
+    为缺少缩略图的图片补生成：新版存储中的用户记录 + 旧版平铺目录中的历史图片
+    :return: 处理的图片数量
+    """
+    storage = image_storage.get_storage()
+    pending = []
+    for record_key in storage.list("users/"):
+        if "/records/" not in record_key or not record_key.endswith(".json"):
+            continue
+        record = json.loads(storage.get(record_key).decode("utf-8"))
+        if record.get("key") and len(record.get("thumbnails", {})) < len(THUMBNAIL_SIZES):
+            pending.append((make_thumbnails, (record["key"], record_key)))
+    for image_path in list_legacy_images(legacy_root):
+        if len(legacy_thumbnails(image_path)) < len(THUMBNAIL_SIZES):
+            pending.append((make_legacy_thumbnails, (image_path,)))
+
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, *args) for func, args in pending]
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                print(f"❌ 缩略图生成失败：{e}")
+    print(f"✅ 缩略图补全完成：{done}/{len(pending)}")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为历史图库补生成缩略图")
+    parser.add_argument("--workers", type=int, default=THUMBNAIL_WORKERS, help="工作进程数")
+    parser.add_argument("--legacy-root", default=LEGACY_GALLERY_ROOT, help="旧版平铺图库根目录")
+    args = parser.parse_args()
+    backfill(args.workers, args.legacy_root)
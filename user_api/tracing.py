@@ -0,0 +1,328 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+import requests
+
+# 1. 链路追踪配置
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")  # jsonl / otlp / none
+TRACE_FILE = os.getenv("TRACE_FILE", "logs/trace.jsonl")  # jsonl导出文件，每个进程写 trace.<pid>.jsonl
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(100 * 1024 * 1024)))  # 超过后轮转为 .1 文件
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")  # OTLP/HTTP JSON接收地址
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "fastapi_user")
+TRACE_HEADER = "X-Trace-Id"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+# 2. Span定义
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # 在其他线程/上下文中结束（如生成器依赖），无需恢复
+                pass
+            self._token = None
+        _exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def start_span(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+               activate: bool = True, **attributes) -> Span:
+    """
+    手动开启一个Span，需调用 span.end() 结束
+    :param activate: 是否设为当前Span（子Span会挂在它下面）
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        parent_id = parent.span_id if parent else parent_id
+    new_span = Span(name, trace_id, parent_id, attributes)
+    if activate:
+        new_span._token = _current_span.set(new_span)
+    return new_span
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    with tracing.span("llm.call", model="qwen-plus"): ...
+    """
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+
+
+def traced(name: Optional[str] = None):
+    """
+    装饰器：为同步/异步函数自动添加Span
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 3. 导出器（后台线程批量写出，不阻塞请求）
+class SpanExporter:
+    def __init__(self, batch_size: int = 100, flush_interval: float = 1.0):
+        self.queue: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, finished: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            pass  # 导出跟不上时直接丢弃，保证请求不受影响
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._drain(block=True)
+            if batch:
+                self._write_safely(batch)
+
+    def _drain(self, block: bool) -> List[Span]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if not block or timeout <= 0:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self) -> None:
+        batch = self._drain(block=False)
+        if batch:
+            self._write_safely(batch)
+
+    def _write_safely(self, batch: List[Span]) -> None:
+        try:
+            self.write(batch)
+        except Exception as e:
+            print(f"❌ 链路数据导出失败：{e}")
+
+    def write(self, batch: List[Span]) -> None:
+        raise NotImplementedError
+
+
+class NoopExporter(SpanExporter):
+    def export(self, finished: Span) -> None:
+        pass
+
+
+class JsonlExporter(SpanExporter):
+    def __init__(self, path: str = TRACE_FILE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def process_path(self) -> str:
+        # 多worker时每个进程写自己的文件，避免不同进程的行交错
+        base, ext = os.path.splitext(self.path)
+        return f"{base}.{os.getpid()}{ext}"
+
+    def write(self, batch: List[Span]) -> None:
+        path = self.process_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) >= TRACE_FILE_MAX_BYTES:
+            os.replace(path, f"{path}.1")  # 只保留一个轮转文件
+        data = "".join(json.dumps(item.to_dict(), ensure_ascii=False, default=str) + "\n" for item in batch)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode("utf-8"))  # 整批一次写入
+        finally:
+            os.close(fd)
+
+
+class OTLPExporter(SpanExporter):
+    """
+    以OTLP/HTTP JSON格式发送到Collector（或兼容的接收服务）
+    """
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT, **kwargs):
+        super().__init__(**kwargs)
+        self.endpoint = endpoint
+
+    @staticmethod
+    def _attributes(attributes: dict) -> list:
+        result = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                result.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                result.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                result.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                result.append({"key": key, "value": {"stringValue": str(value)}})
+        return result
+
+    def write(self, batch: List[Span]) -> None:
+        spans = [{
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            "parentSpanId": item.parent_id or "",
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns),
+            "attributes": self._attributes(item.attributes),
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+        } for item in batch]
+        body = {"resourceSpans": [{
+            "resource": {"attributes": self._attributes({"service.name": TRACE_SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+        requests.post(self.endpoint, json=body, timeout=5).raise_for_status()
+
+
+def _create_exporter() -> SpanExporter:
+    if TRACE_EXPORTER == "otlp":
+        return OTLPExporter()
+    if TRACE_EXPORTER == "jsonl":
+        return JsonlExporter()
+    return NoopExporter()
+
+
+_exporter = _create_exporter()
+atexit.register(_exporter.flush)
+
+
+def _reset_after_fork():
+    # 预加载后fork出的worker不会继承导出线程，需重新启动
+    _exporter._thread = None
+    _exporter._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# 4. ASGI中间件：每个请求一个trace id，并通过响应头返回
+def _parse_traceparent(value: str):
+    # W3C traceparent: 00-<trace_id 32位>-<span_id 16位>-<flags>
+    parts = value.split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+def _is_trace_id(value: str) -> bool:
+    return len(value) == 32 and all(c in "0123456789abcdef" for c in value)
+
+
+class TraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        trace_id, parent_id = _parse_traceparent(headers.get("traceparent", ""))
+        if trace_id is None:
+            incoming = headers.get(TRACE_HEADER.lower(), "").lower()
+            trace_id = incoming if _is_trace_id(incoming) else uuid.uuid4().hex
+
+        request_span = start_span("http.request", trace_id=trace_id, parent_id=parent_id,
+                                  method=scope.get("method"), path=scope.get("path"))
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                request_span.set_attribute("status_code", message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (TRACE_HEADER.encode("latin-1"), trace_id.encode("latin-1")),
+                    (b"traceparent", f"00-{trace_id}-{request_span.span_id}-01".encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            request_span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            request_span.end()
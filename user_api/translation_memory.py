@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只有进程内的 self._lock 互斥
+    fcntl = None
+
+# 1. 翻译记忆配置
+TM_ENABLED = os.getenv("TM_ENABLED", "1") == "1"
+TM_DIR = os.getenv("TM_DIR", "data/translation_memory")
+# 宽松匹配：原文仅空白、标点不同也视为命中（默认关闭，只做精确匹配）
+# 不做相似度模糊匹配：相似句子（如多一个“not”、金额不同）的译文原样返回会产生错误翻译
+TM_LOOSE_MATCH = os.getenv("TM_LOOSE_MATCH", "0") == "1"
+
+_SPACES = re.compile(r"\s+")
+
+
+class TMMatch(NamedTuple):
+    translation: str
+    keywords: List[str]
+    exact: bool  # False表示宽松匹配（仅空白、标点不同）
+    source: str
+
+
+def normalize(text: str) -> str:
+    return _SPACES.sub(" ", text.strip())
+
+
+def skeleton(text: str) -> str:
+    """
+    去掉空白和标点后的原文，用于宽松匹配
+    """
+    return "".join(c for c in text if not c.isspace() and not unicodedata.category(c).startswith("P"))
+
+
+# 2. 翻译记忆库：精确匹配字典 + 宽松匹配字典
+class TranslationMemory:
+    def __init__(self, directory: str = TM_DIR, loose: bool = TM_LOOSE_MATCH):
+        """
+        磁盘格式：snapshot.z（zlib压缩的全部条目）+ append.log（新增条目，每行一条JSON）
+        追加与压缩合并通过 tm.lock 文件锁互斥；压缩后日志换成新文件，其他进程按inode变化重新加载
+        """
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.z")
+        self.log_path = os.path.join(directory, "append.log")
+        self.lock_path = os.path.join(directory, "tm.lock")
+        self.loose = loose
+        self._lock = threading.Lock()
+        self._reset()
+        self.load()
+
+    def _reset(self):
+        self.entries: List[Tuple[str, str, str, List[str]]] = []  # (原文, 目标语言, 译文, 关键词)
+        self.exact: Dict[Tuple[str, str], int] = {}
+        self.skeletons: Dict[Tuple[str, str], int] = {}
+        self._log_offset = 0
+        self._log_inode = None
+
+    @contextmanager
+    def _file_lock(self):
+        # 跨worker进程互斥：追加与压缩合并不能交错
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- 加载/持久化 ----------
+    def load(self) -> None:
+        with self._lock:
+            self._reset()
+            self._load_snapshot()
+            self._read_log()
+
+    def _load_snapshot(self) -> None:
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                for item in json.loads(zlib.decompress(f.read()).decode("utf-8")):
+                    self._insert(*item)
+
+    def _read_log(self) -> None:
+        """
+        读取其他worker进程追加的新条目（增量读取）
+        """
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            if self._log_inode is None:
+                self._log_inode = 0  # 日志出现时（可能已经历过压缩合并）重新加载快照
+            return
+        if self._log_inode is not None and stat.st_ino != self._log_inode:
+            # 日志已被压缩合并（替换为新文件），先加载新快照再从头读新日志
+            self._reset()
+            self._load_snapshot()
+        self._log_inode = stat.st_ino
+        if stat.st_size == self._log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 其他进程正在写入的半行，下次再读
+                self._log_offset += len(line)
+                try:
+                    self._insert(*json.loads(line.decode("utf-8")))
+                except (ValueError, TypeError):
+                    continue
+
+    def compact(self) -> None:
+        """
+        把追加日志合并进压缩快照，可在worker运行时执行
+        先替换快照再替换日志：其他进程发现日志inode变化时，新快照已经就位
+        """
+        with self._lock, self._file_lock():
+            self._read_log()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(json.dumps(self.entries, ensure_ascii=False).encode("utf-8"), 9))
+            os.replace(tmp_path, self.snapshot_path)
+            tmp_log = self.log_path + ".tmp"
+            open(tmp_log, "wb").close()
+            os.replace(tmp_log, self.log_path)
+            self._log_inode = os.stat(self.log_path).st_ino
+            self._log_offset = 0
+
+    # ---------- 写入 ----------
+    def _insert(self, source: str, target_lang: str, translation: str, keywords: List[str]) -> None:
+        key = (normalize(source), target_lang)
+        entry = (key[0], target_lang, translation, keywords)
+        idx = self.exact.get(key)
+        if idx is not None:
+            self.entries[idx] = entry
+            return
+        idx = len(self.entries)
+        self.entries.append(entry)
+        self.exact[key] = idx
+        self.skeletons[(skeleton(key[0]), target_lang)] = idx
+
+    def add(self, source: str, target_lang: str, translation: str, keywords: List[str]) -> None:
+        item = [normalize(source), target_lang, translation, list(keywords)]
+        with self._lock, self._file_lock():
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.log_path, "ab") as f:
+                f.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+            # 其他worker可能在本条之前追加了条目，从当前偏移重新读取（包括本条），不直接推进偏移
+            self._read_log()
+
+    # ---------- 查询 ----------
+    def lookup(self, source: str, target_lang: str) -> Optional[TMMatch]:
+        with self._lock:
+            self._read_log()
+            text = normalize(source)
+            idx = self.exact.get((text, target_lang))
+            if idx is None and self.loose:
+                idx = self.skeletons.get((skeleton(text), target_lang))
+            if idx is None:
+                return None
+            entry = self.entries[idx]
+            return TMMatch(entry[2], entry[3], entry[0] == text, entry[0])
+
+
+# 3. 全局实例（每个worker进程各自加载）
+_memory: Optional[TranslationMemory] = None
+
+
+def get_memory() -> TranslationMemory:
+    global _memory
+    if _memory is None:
+        _memory = TranslationMemory()
+    return _memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="翻译记忆库维护")
+    parser.add_argument("command", choices=["compact", "stats"], help="compact：合并追加日志；stats：查看条目数")
+    args = parser.parse_args()
+    memory = get_memory()
+    if args.command == "compact":
+        memory.compact()
+    print(f"✅ 翻译记忆条目数：{len(memory.entries)}")
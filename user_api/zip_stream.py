@@ -0,0 +1,202 @@
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# 流式ZIP打包：不压缩（STORED）、CRC写在数据描述符中，边读边发送，不落临时文件
+# 文件大小预先已知，因此整个压缩包的长度和每个字节的位置都可以提前算出，支持Range断点续传
+
+ZIP64_LIMIT = 0xFFFFFFFF  # 超过该值的大小/偏移需使用ZIP64扩展
+MAX_UINT32 = 0xFFFFFFFF  # ZIP64中表示“见扩展字段”的占位值
+FLAGS = 0x0808  # bit3：使用数据描述符；bit11：文件名为UTF-8
+CRC_CACHE_SIZE = 64  # 缓存最近多少个压缩包（按ETag）的CRC；仅用于记录中没有crc32的旧图片，续传时无需重读区间之前的文件
+
+
+class ZipEntry:
+    def __init__(self, name: str, size: int, chunks: Callable[[], Iterable[bytes]],
+                 mtime: Optional[float] = None, fingerprint: str = "", crc: Optional[int] = None):
+        """
+        :param name: 压缩包内路径
+        :param size: 文件字节数（必须准确）
+        :param chunks: 调用后返回文件内容分块迭代器
+        :param mtime: 修改时间戳
+        :param fingerprint: 内容标识（内容哈希或修改时间），参与ETag计算，内容变化时必须随之变化
+        :param crc: 预先保存的CRC32；已知时续传无需重读区间之前的内容
+        """
+        self.name = name.encode("utf-8")
+        self.size = size
+        self.chunks = chunks
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.dos_time, self.dos_date = _dos_datetime(mtime)
+        self.offset = 0
+        self.zip64 = False
+        self.crc = crc
+
+    @property
+    def header_size(self) -> int:
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    @property
+    def descriptor_size(self) -> int:
+        return 24 if self.zip64 else 16
+
+    @property
+    def total_size(self) -> int:
+        return self.header_size + self.size + self.descriptor_size
+
+
+def _dos_datetime(timestamp: Optional[float]):
+    dt = datetime.fromtimestamp(timestamp) if timestamp else datetime.now()
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2), \
+        ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+
+
+# 按ETag缓存各条目的CRC：ETag相同则内容相同，CRC可直接复用
+_crc_cache: "OrderedDict[str, Dict[bytes, int]]" = OrderedDict()
+_crc_lock = threading.Lock()
+
+
+def _cached_crcs(etag: str) -> Dict[bytes, int]:
+    with _crc_lock:
+        crcs = _crc_cache.setdefault(etag, {})
+        _crc_cache.move_to_end(etag)
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+        return crcs
+
+
+class ZipStream:
+    def __init__(self, entries: List[ZipEntry]):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            entry.zip64 = entry.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+            offset += entry.total_size
+        self.cd_offset = offset
+        self.cd_size = sum(46 + len(e.name) + (28 if e.zip64 else 0) for e in entries)
+        self.zip64 = (len(entries) >= 0xFFFF or self.cd_offset >= ZIP64_LIMIT
+                      or self.cd_size >= ZIP64_LIMIT)
+        self.size = self.cd_offset + self.cd_size + (76 if self.zip64 else 0) + 22
+        self.etag = self._etag()
+        self._crcs = _cached_crcs(self.etag)
+        for entry in entries:
+            if entry.crc is None:
+                entry.crc = self._crcs.get(entry.name)
+
+    def _etag(self) -> str:
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(b"\0".join([entry.name, str(entry.size).encode(), str(entry.mtime).encode(),
+                                      entry.fingerprint.encode()]) + b"\n")
+        return f'"{digest.hexdigest()}"'
+
+    # ---------- 各部分二进制结构 ----------
+    @staticmethod
+    def _local_header(entry: ZipEntry) -> bytes:
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if entry.zip64 else b""
+        return struct.pack("<IHHHHHIIIHH", 0x04034b50, 45 if entry.zip64 else 20, FLAGS, 0,
+                           entry.dos_time, entry.dos_date, 0, 0, 0,
+                           len(entry.name), len(extra)) + entry.name + extra
+
+    @staticmethod
+    def _descriptor(entry: ZipEntry) -> bytes:
+        if entry.zip64:
+            return struct.pack("<IIQQ", 0x08074b50, entry.crc, entry.size, entry.size)
+        return struct.pack("<IIII", 0x08074b50, entry.crc, entry.size, entry.size)
+
+    @staticmethod
+    def _central_header(entry: ZipEntry) -> bytes:
+        if entry.zip64:
+            extra = struct.pack("<HHQQQ", 1, 24, entry.size, entry.size, entry.offset)
+            size = offset = MAX_UINT32
+        else:
+            extra, size, offset = b"", entry.size, entry.offset
+        version = 45 if entry.zip64 else 20
+        return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, version, version, FLAGS, 0,
+                           entry.dos_time, entry.dos_date, entry.crc, size, size,
+                           len(entry.name), len(extra), 0, 0, 0, 0, offset) + entry.name + extra
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        if not self.zip64:
+            return struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, self.cd_size, self.cd_offset, 0)
+        zip64_offset = self.cd_offset + self.cd_size
+        return struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0,
+                           count, count, self.cd_size, self.cd_offset) + \
+            struct.pack("<IIQI", 0x07064b50, 0, zip64_offset, 1) + \
+            struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, MAX_UINT32, MAX_UINT32, 0)
+
+    # ---------- 输出 ----------
+    def _read(self, entry: ZipEntry) -> Iterator[bytes]:
+        crc = 0
+        length = 0
+        for chunk in entry.chunks():
+            crc = zlib.crc32(chunk, crc)
+            length += len(chunk)
+            yield chunk
+        if length != entry.size:
+            raise IOError(f"文件大小与预期不一致：{entry.name.decode('utf-8')}")
+        entry.crc = crc
+        self._crcs[entry.name] = crc
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        按字节区间[start, end]输出压缩包内容（end包含在内，默认到结尾）
+        区间之前的文件仅在需要其CRC（区间覆盖中央目录）且缓存中没有时才读取
+        """
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        need_crc = end >= self.cd_offset
+
+        def clip(pos: int, data: bytes):
+            if pos + len(data) <= start or pos > end:
+                return b""
+            return data[max(0, start - pos):end - pos + 1]
+
+        for entry in self.entries:
+            if entry.offset > end:
+                return
+            if entry.offset + entry.total_size <= start and (not need_crc or entry.crc is not None):
+                continue  # 整个条目都在区间之前，且不需要（或已缓存）其CRC，跳过读取
+            pos = entry.offset
+            header = clip(pos, self._local_header(entry))
+            if header:
+                yield header
+            pos += entry.header_size
+            for chunk in self._read(entry):
+                if pos > end:
+                    return
+                piece = clip(pos, chunk)
+                if piece:
+                    yield piece
+                pos += len(chunk)
+            descriptor = clip(pos, self._descriptor(entry))
+            if descriptor:
+                yield descriptor
+
+        if not need_crc:
+            return
+        pos = self.cd_offset
+        for entry in self.entries:
+            header = self._central_header(entry)
+            piece = clip(pos, header)
+            if piece:
+                yield piece
+            pos += len(header)
+        piece = clip(pos, self._end_records())
+        if piece:
+            yield piece
+
+
+def lazy_bytes_entry(name: str, build: Callable[[], bytes], mtime: Optional[float] = None) -> ZipEntry:
+    """
+    内容由build()按需生成（结果须确定），只保留大小和哈希，不常驻内存
+    """
+    data = build()
+    return ZipEntry(name, len(data), lambda: [build()], mtime, hashlib.sha1(data).hexdigest())